@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the scrape hot path on recorded, anonymized TG3442DE pages (see fixtures.py).
+
+Times every extractor's extract(), a full TG3442DECollector.collect() in simulate mode and the
+text exposition, and reports operations per second and peak memory (tracemalloc).
+
+Usage (from the repository root):
+    python3 benchmarks/bench_extractors.py [--profile small|large] [--min-time 1.0]
+                                           [--save results.json] [--compare results.json]
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from prometheus_client import CollectorRegistry, generate_latest
+
+from tg3442de_exporter.config import DEFAULT_CONFIG, EXPORTER, EXTRACTORS, SIMULATE
+from tg3442de_exporter.html2metric import get_metrics_extractor
+from tg3442de_exporter.tg3442de_exporter import TG3442DECollector
+from fixtures import PROFILES, write_fixtures
+
+ALL_EXTRACTORS = [
+    "device_status", "docsis_status", "overview_status", "phone_status",
+    "call_log", "call_log_local", "event_log_local",
+]
+
+# results slower than the saved ones by more than this factor are reported as regression
+REGRESSION_FACTOR = 1.2
+
+
+class _FamiliesCollector(object):
+    def __init__(self, families):
+        self.families = families
+
+    def collect(self):
+        return self.families
+
+
+def measure(function, min_time: float):
+    """
+    Runs function repeatedly for at least min_time seconds
+    :return: operations per second, peak memory in bytes of a single run
+    """
+    function()  # warm up, e.g. local log files are created on the first run
+
+    tracemalloc.start()
+    function()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return runs / elapsed, peak_memory
+
+
+def exporter_config():
+    config = copy.deepcopy(DEFAULT_CONFIG[EXPORTER])
+    config[EXTRACTORS] = ALL_EXTRACTORS
+    config[SIMULATE] = 1
+    return config
+
+
+def run_profile(profile: str, logger, min_time: float):
+    results = {}
+    pages = write_fixtures(os.getcwd(), profile)
+    config = exporter_config()
+
+    for name in ALL_EXTRACTORS:
+        extractor = get_metrics_extractor(name, logger, config)
+        raw_htmls = {page: pages[page] for page in extractor.pages}
+        results[f"extract {name}"] = measure(lambda: list(extractor.extract(raw_htmls)), min_time)
+
+    collector = TG3442DECollector(logger, "simulate", "", config)
+    results["collect"] = measure(lambda: list(collector.collect()), min_time)
+
+    families = _FamiliesCollector(list(collector.collect()))
+    results["exposition"] = measure(lambda: generate_latest(families), min_time)
+
+    registry = CollectorRegistry()
+    registry.register(collector)
+    results["collect + exposition"] = measure(lambda: generate_latest(registry), min_time)
+    collector.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=sorted(PROFILES.keys()), action="append")
+    parser.add_argument("--min-time", type=float, default=1.0, help="seconds per measurement")
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--compare", help="compare with results written by --save")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    all_results = {}
+    regressions = 0
+    for profile in args.profile or sorted(PROFILES.keys()):
+        # simulate mode and the local log extractors work relative to the current directory
+        with tempfile.TemporaryDirectory() as directory:
+            cwd = os.getcwd()
+            os.chdir(directory)
+            try:
+                results = run_profile(profile, logger, args.min_time)
+            finally:
+                os.chdir(cwd)
+
+        print(f"\nprofile '{profile}' {PROFILES[profile]}")
+        print(f"{'benchmark':<32}{'ops/sec':>12}{'peak memory':>14}")
+        for name, (ops, peak_memory) in results.items():
+            line = f"{name:<32}{ops:>12.1f}{peak_memory / 1024:>11.1f} KB"
+            saved = baseline.get(profile, {}).get(name)
+            if saved is not None:
+                ratio = saved[0] / ops
+                line += f"  {ratio:5.2f}x time of saved"
+                if ratio > REGRESSION_FACTOR:
+                    line += "  REGRESSION"
+                    regressions += 1
+            print(line)
+        all_results[profile] = results
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(all_results, f, indent=1)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
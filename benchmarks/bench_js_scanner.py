@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the single-pass javascript variable scanner against the former per-field regexes,
+after checking that both find the same values.
+
+Usage (from the repository root):
+    python3 benchmarks/bench_js_scanner.py [iterations]
+"""
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tg3442de_exporter.js_scanner import scan_js_vars
+
+# per-field patterns as used by the extractors before the scanner
+LEGACY_PATTERNS = [
+    r".*var js_SerialNumber = '(.*)';.*",
+    r".*var js_FWVersion = '(.*)';.*",
+    r".*var js_HWTypeVersion = '(.*)';.*",
+    r".*var js_UptimeSinceReboot = '(\d+),(\d+),(\d+)';.*",
+    r".*js_isCmOperational = '(.*)';.*",
+    r".*js_wifiEnable = '(.*)';.*",
+    r".*js_guestWifiEnable = '(.*)';.*",
+    r".*js_wpsEnable = '(.*)';.*",
+    r".*js_scheduleEnable = '(.*)';.*",
+    r".*var js_NumberOfLine = '(.*)';.*",
+] + [
+    pattern.format(line_no)
+    for line_no in range(1, 3)
+    for pattern in [
+        r".*var js_TELF{}_Number = '(.*)';.*",
+        r".*var js_TELF{}_CallPState = '(.*)';.*",
+        r".*var js_TELF{}_HookState = '(.*)';.*",
+    ]
+]
+
+
+def build_page(filler_lines: int) -> str:
+    """
+    Page with all variables read by the extractors, surrounded by unrelated javascript like the modem serves it
+    """
+    filler = "\n".join(
+        f"    $('#row{i}').html(translate('PAGE_LABEL_{i}') + ' ' + value_{i});" for i in range(filler_lines)
+    )
+    variables = "\n".join([
+        "var js_SerialNumber = 'AAAA00000000';",
+        "var js_FWVersion = 'AR01.04.046.17_060822_7244.SIP.10.X1';",
+        "var js_HWTypeVersion = '7';",
+        "var js_UptimeSinceReboot = '32,00,59';",
+        "var js_isCmOperational = 'true';",
+        "var js_wifiEnable = 'true';",
+        "var js_guestWifiEnable = 'false';",
+        "var js_wpsEnable = 'false';",
+        "var js_scheduleEnable = 'false';",
+        "var js_NumberOfLine = '2';",
+        "var js_TELF1_Number = '0301234567';",
+        "var js_TELF1_CallPState = 'Idle';",
+        "var js_TELF1_HookState = 'On';",
+        "var js_TELF2_Number = '0301234568';",
+        "var js_TELF2_CallPState = 'Idle';",
+        "var js_TELF2_HookState = 'On';",
+    ])
+    return f"<script>\n{filler}\n{variables}\n{filler}\n</script>\n"
+
+
+def legacy(page: str):
+    return [re.search(pattern, page) for pattern in LEGACY_PATTERNS]
+
+
+def scanner(page: str):
+    return scan_js_vars(page)
+
+
+def check():
+    """
+    The scanner finds the same values as the per-field regexes, also for several assignments on one line
+    """
+    page = build_page(10)
+    js_vars = scan_js_vars(page)
+    for pattern, match in zip(LEGACY_PATTERNS, legacy(page)):
+        name = re.search(r"(js_\w+)", pattern).group(1)
+        if match.lastindex == 1:
+            assert js_vars[name] == match.group(1), name
+    assert scan_js_vars("var js_a = '1'; var js_b = '2';") == {"js_a": "1", "js_b": "2"}
+    assert scan_js_vars("var js_a = 'x;y'; var json_b = [{\"c\":\"d\"}];") == {"js_a": "x;y", "json_b": '[{"c":"d"}]'}
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    check()
+    for filler_lines in [10, 100, 1000]:
+        page = build_page(filler_lines)
+        legacy_seconds = timeit.timeit(lambda: legacy(page), number=iterations) / iterations
+        scanner_seconds = timeit.timeit(lambda: scanner(page), number=iterations) / iterations
+        print(
+            f"{len(page):>8} bytes: per-field regex {legacy_seconds * 1e6:10.1f} us, "
+            f"scanner {scanner_seconds * 1e6:10.1f} us, speedup {legacy_seconds / scanner_seconds:6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Anonymized TG3442DE pages for benchmarks, modelled on the responses of firmware
+AR01.04.046.17_060822_7244.SIP.10.X1. Serial numbers, MAC and IP addresses, host names and phone
+numbers are synthetic. The pages are written in the layout expected by the `simulate` option.
+"""
+
+import json
+import os
+from datetime import datetime
+from typing import Dict
+
+from tg3442de_exporter.device_status_extractor import GET_STATUS_STATUS
+from tg3442de_exporter.docsis_status_extractor import GET_STATUS_DOCSIS
+from tg3442de_exporter.overview_extractor import GET_OVERVIEW
+from tg3442de_exporter.phone_status_extractor import GET_STATUS_PHONE
+from tg3442de_exporter.call_log_extractor import GET_CALL_LOG
+from tg3442de_exporter.event_log_local_extractor import GET_EVENT_LOG_LOCAL
+
+# number of downstream channels, attached devices and log records per profile
+PROFILES = {
+    "small": {"channels": 8, "devices": 5, "records": 10},
+    "large": {"channels": 32, "devices": 200, "records": 10000},
+}
+
+EVENT_MESSAGES = [
+    ("3", "No Ranging Response received - T3 time-out;CM-MAC=XX:XX:XX:XX:XX:XX;CMTS-MAC=XX:XX:XX:XX:XX:XX;CM-QOS=1.1;CM-VER=3.1;"),
+    ("3", "Ranging Request Retries exhausted;CM-MAC=XX:XX:XX:XX:XX:XX;CMTS-MAC=XX:XX:XX:XX:XX:XX;CM-QOS=1.1;CM-VER=3.1;"),
+    ("3", "Started Unicast Maintenance Ranging - No Response received - T3 time-out;CM-MAC=XX:XX:XX:XX:XX:XX;"),
+    ("5", "Lost MDD Timeout;CM-MAC=XX:XX:XX:XX:XX:XX;CMTS-MAC=XX:XX:XX:XX:XX:XX;CM-QOS=1.1;CM-VER=3.1;"),
+    ("6", "CM-STATUS message sent. Event Type Code: 16; Chan ID: 33; DSID: N/A; MAC Addr: N/A; OFDM/OFDMA Profile ID: N/A."),
+    ("3", "SYNC Timing Synchronization failure - Loss of Sync;CM-MAC=XX:XX:XX:XX:XX:XX;"),
+    ("6", "Cable Modem Reboot because of - power on"),
+]
+
+
+def page_filename(page: str) -> str:
+    # same mapping as read_simulated_page
+    return f"{page[5:page.find('.php')]}.txt"
+
+
+def status_status_page() -> str:
+    return "\n".join([
+        "<script>",
+        "var js_SerialNumber = 'AAAA00000000';",
+        "var js_FWVersion = 'AR01.04.046.17_060822_7244.SIP.10.X1';",
+        "var js_HWTypeVersion = '7';",
+        "var js_UptimeSinceReboot = '32,00,59';",
+        "var js_DateTime = '18.10.2026 12:00:00';",
+        "</script>",
+    ])
+
+
+def status_docsis_page(channels: int) -> str:
+    downstream = []
+    for channel in range(1, channels + 1):
+        ofdm = channel > channels - 2 and channels > 8
+        downstream.append({
+            "ChannelID": str(channel),
+            "ChannelType": "OFDM" if ofdm else "SC-QAM",
+            "Modulation": "4096QAM" if ofdm else "256QAM",
+            "LockStatus": "Locked",
+            "Frequency": "151~324" if ofdm else str(114 + 8 * channel),
+            "PowerLevel": "{:.1f}/{:.1f}".format(2.0 + (channel % 7) * 0.4, 62.0 + (channel % 7) * 0.4),
+            "SNRLevel": str(36 + channel % 5),
+        })
+    upstream = []
+    for channel in range(1, 5):
+        upstream.append({
+            "ChannelID": str(channel),
+            "ChannelType": "SC-QAM",
+            "Modulation": "64QAM",
+            "LockStatus": "SUCCESS",
+            "Frequency": "{:.1f}".format(30.8 + 6.4 * channel),
+            "PowerLevel": "{:.1f}/{:.1f}".format(44.0 + channel * 0.5, 104.0 + channel * 0.5),
+        })
+    return "\n".join([
+        "<script>",
+        f"var json_dsData = {json.dumps(downstream)};",
+        f"var json_usData = {json.dumps(upstream)};",
+        "</script>",
+    ])
+
+
+def _devices(devices: int, first: int, link_speed: str) -> list:
+    return [
+        {
+            "Index": index,
+            "HostName": f"host-{index:04d}",
+            "MAC": "02:00:00:00:{:02X}:{:02X}".format(index // 256, index % 256),
+            "IPv4": "192.168.0.{}".format(10 + index % 240),
+            "IPv6": "fd00::{:x}".format(index),
+            link_speed: "1 Gbps" if link_speed == "Speed" else "{} Mbps".format(72 + index % 800),
+        }
+        for index in range(first, first + devices)
+    ]
+
+
+def overview_page(devices: int) -> str:
+    lan = max(devices // 5, 1)
+    guest = devices // 5
+    primary = devices - lan - guest
+    return "\n".join([
+        "<script>",
+        f"var json_lanAttachedDevice = {json.dumps(_devices(lan, 0, 'Speed'))};",
+        f"var json_primaryWlanAttachedDevice = {json.dumps(_devices(primary, lan, 'LinkRate'))};",
+        f"var json_guestWlanAttachedDevice = {json.dumps(_devices(guest, lan + primary, 'LinkRate'))};",
+        f"var js_lanHostNums = '{lan}';",
+        f"var js_primaryWlanHostNums = '{primary}';",
+        f"var js_guestWlanHostNums = '{guest}';",
+        "var js_isCmOperational = 'true';",
+        "var js_wifiEnable = 'true';",
+        "var js_guestWifiEnable = 'true';",
+        "var js_wpsEnable = 'false';",
+        "var js_scheduleEnable = 'false';",
+        "</script>",
+    ])
+
+
+def status_voice_page() -> str:
+    lines = ["<script>", "var js_NumberOfLine = '2';"]
+    for line_no in range(1, 3):
+        lines += [
+            f"var js_TELF{line_no}_Number = '03000000{line_no:02d}';",
+            f"var js_TELF{line_no}_CallPState = 'Idle';",
+            f"var js_TELF{line_no}_HookState = 'On';",
+        ]
+    return "\n".join(lines + ["</script>"])
+
+
+def phone_call_log_page(records: int) -> str:
+    # newest entry first, one call every 17 minutes going back from a fixed date
+    base = 1760788800
+    phone_log_record = []
+    for index in range(records):
+        call_time = datetime.utcfromtimestamp(base - index * 17 * 60)
+        phone_log_record.append({
+            "ParameterIndex": str(records - index),
+            "CallType": str(1 + index % 3),
+            "Date": "PAGE_CALL_LOG_TABLE_TODAY" if index == 0 else call_time.strftime("%d.%m.%Y"),
+            "Time": call_time.strftime("%H:%M"),
+            "ExternalNumber": "0300000{:04d}".format(index % 10000),
+            "Duration": "{}:{:02d}".format(index % 30, index % 60),
+        })
+    return json.dumps({"PhoneLogRecord": phone_log_record})
+
+
+def event_log_page(records: int) -> str:
+    base = 1760788800
+    event_log = []
+    for index in range(records):
+        priority, message = EVENT_MESSAGES[index % len(EVENT_MESSAGES)]
+        event_log.append({
+            "Index": str(index + 1),
+            "Timestamp": str(base - index * 90),
+            "Priority": priority,
+            "Message": message,
+        })
+    return json.dumps({"eventLog": event_log})
+
+
+def build_pages(profile: str) -> Dict[str, str]:
+    """
+    :param profile: key of PROFILES
+    :return: page content by page
+    """
+    sizes = PROFILES[profile]
+    return {
+        GET_STATUS_STATUS: status_status_page(),
+        GET_STATUS_DOCSIS: status_docsis_page(sizes["channels"]),
+        GET_OVERVIEW: overview_page(sizes["devices"]),
+        GET_STATUS_PHONE: status_voice_page(),
+        GET_CALL_LOG: phone_call_log_page(sizes["records"]),
+        GET_EVENT_LOG_LOCAL: event_log_page(sizes["records"]),
+    }
+
+
+def write_fixtures(directory: str, profile: str) -> Dict[str, str]:
+    """
+    Writes the pages of a profile to <directory>/simulate/ for the `simulate` option
+    :return: page content by page
+    """
+    pages = build_pages(profile)
+    simulate_dir = os.path.join(directory, "simulate")
+    os.makedirs(simulate_dir, exist_ok=True)
+    for page, content in pages.items():
+        with open(os.path.join(simulate_dir, page_filename(page)), "w") as f:
+            f.write(content)
+    return pages
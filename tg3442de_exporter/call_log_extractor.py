@@ -1,7 +1,6 @@
 from asyncio.log import logger
 from logging import Logger
 from typing import Iterable, Set, Dict
-import json
 from datetime import datetime, timedelta
 
 from tg3442de_exporter.html_metrics_extractor import HtmlMetricsExtractor
@@ -16,6 +15,9 @@ GET_CALL_LOG = '/php/phone_call_log_data.php?{%22PhoneLogRecord%22:{}}'
 
 
 class CallLogExtractor(HtmlMetricsExtractor):
+    # metrics depend on dates relative to today, not only on the page content
+    cacheable = False
+
     def __init__(self, logger: Logger, exporter_config: Dict):
         super(CallLogExtractor, self).__init__(
             CALL_LOG, {GET_CALL_LOG}, logger
@@ -31,7 +33,7 @@ class CallLogExtractor(HtmlMetricsExtractor):
             return
 
         # parse json
-        json_phone_log_dat = json.loads(raw_html)
+        json_phone_log_dat = self.json_loads(raw_html)
 
         phone_log_record = json_phone_log_dat['PhoneLogRecord']
         no_entries = len(phone_log_record)
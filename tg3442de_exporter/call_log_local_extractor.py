@@ -1,9 +1,9 @@
 from logging import Logger
-from typing import Iterable, Set, Dict
-import json
+from typing import Iterable, Optional, Set, Dict
 from datetime import datetime, timedelta
 
 from tg3442de_exporter.html_metrics_extractor import HtmlMetricsExtractor
+from tg3442de_exporter.log_store import LogStore, log_retention
 from prometheus_client import Metric
 from prometheus_client.metrics_core import (
     GaugeMetricFamily,
@@ -13,17 +13,59 @@ from prometheus_client.metrics_core import (
 CALL_LOG_LOCAL = 'call_log_local'
 GET_CALL_LOG_LOCAL = '/php/phone_call_log_data.php?{%22PhoneLogRecord%22:{}}'
 
+# fields identifying a row of the call log, ParameterIndex changes with each new entry
+CALL_LOG_ROW_FIELDS = ['CallType', 'Date', 'Time', 'ExternalNumber', 'Duration']
+
+
+def call_timestamp(key: str, log_entry: Dict) -> Optional[float]:
+    # keys are the unix timestamps of the calls
+    try:
+        return float(key)
+    except ValueError:
+        return None
+
 
 class CallLogLocalExtractor(HtmlMetricsExtractor):
+    # metrics depend on the local store, not only on the page content
+    cacheable = False
+
     def __init__(self, logger: Logger, exporter_config: Dict):
         super(CallLogLocalExtractor, self).__init__(
             CALL_LOG_LOCAL, {GET_CALL_LOG_LOCAL}, logger
         )
         self.logger = logger
         self.call_log_filename = exporter_config['call_log_filename']
+        self.store = LogStore(self.call_log_filename, logger, call_timestamp, log_retention(exporter_config))
+        # newest row of the previous scrape, as served by the TG3442DE
+        self.newest_row = None
+
+    def new_log_entries(self, phone_log_record):
+        """
+        Converts the rows newer than the newest stored call. The TG3442DE lists the newest call first,
+        so conversion stops at the first row at or below the high-water mark of the store.
+        """
+        high_water_mark = self.store.high_water_mark
+        date_format = '%d.%m.%Y' # '%Y-%m-%d'
+        log_entries = []
+        for log_entry in phone_log_record:
+            # change of day seems to be UTC based
+            if log_entry['Date'] == "PAGE_CALL_LOG_TABLE_TODAY":
+                log_entry['Date'] = datetime.strftime(datetime.utcnow(), date_format)
+            elif log_entry['Date'] == "PAGE_CALL_LOG_TABLE_YESTERDAY":
+                log_entry['Date'] = datetime.strftime(datetime.utcnow() - timedelta(1), date_format)
+            # add unix timestamp for sorting
+            dt = "{}-{}".format(log_entry['Date'], log_entry['Time'])
+            key = datetime.strptime(dt,'%d.%m.%Y-%H:%M').timestamp()
+            if high_water_mark is not None and key <= high_water_mark:
+                break
+            # remove ParameterIndex because this value changes for each new entry
+            del log_entry['ParameterIndex']
+            log_entries.append((str(key), log_entry))
+        return log_entries
 
     def extract(self, raw_htmls: Dict[str, bytes]) -> Iterable[Metric]:
         self.logger.debug("CallLogLocal")
+        yield from self.store.metrics('tg3442de_call_log_local', 'Call Log')
 
         # parse Call Log
         raw_html = raw_htmls[GET_CALL_LOG_LOCAL]
@@ -31,52 +73,26 @@ class CallLogLocalExtractor(HtmlMetricsExtractor):
             return
 
         # parse json
-        json_phone_log_dat = json.loads(raw_html)
+        json_phone_log_dat = self.json_loads(raw_html)
 
         phone_log_record = json_phone_log_dat['PhoneLogRecord']
         no_entries = len(phone_log_record)
         if no_entries == 0:
             return
 
-        no_entries_added = 0
-        log_entries = {}
-        for index in range(no_entries):
-
-            date_format = '%d.%m.%Y' # '%Y-%m-%d'
-            log_entry = phone_log_record[index]
-            # change of day seems to be UTC based
-            if log_entry['Date'] == "PAGE_CALL_LOG_TABLE_TODAY":
-                log_entry['Date'] = datetime.strftime(datetime.utcnow(), date_format)            
-            elif log_entry['Date'] == "PAGE_CALL_LOG_TABLE_YESTERDAY":
-                log_entry['Date'] = datetime.strftime(datetime.utcnow() - timedelta(1), date_format)
-            # remove ParameterIndex because this value changes for each new entry
-            del log_entry['ParameterIndex'] 
-            # add unix timestamp for sorting
-            dt = "{}-{}".format(log_entry['Date'], log_entry['Time'])
-            key = datetime.strptime(dt,'%d.%m.%Y-%H:%M').timestamp()
-            log_entries[str(key)] = log_entry
+        # nothing to do if the newest row did not change since the last scrape
+        newest_row = [phone_log_record[0].get(field) for field in CALL_LOG_ROW_FIELDS]
+        if newest_row == self.newest_row:
+            new_log_entries = []
+        else:
+            new_log_entries = self.new_log_entries(phone_log_record)
 
-        # TODO: For large call logs work on files directly and not in memory
-        # read stored call log
-        old_log_entries = {}
+        no_entries_added = 0
         try:
-            with open(self.call_log_filename,'r') as in_file: 
-              old_log_entries = json.load(in_file)
+            no_entries_added = self.store.append(new_log_entries)
+            self.newest_row = newest_row
         except IOError as e:
-            self.logger.info("Cannot read old call_log :" +str(e))
-
-        # merge entries
-        no_old_entries = len(old_log_entries)
-        old_log_entries.update(log_entries)
-        no_entries_added = len(old_log_entries) - no_old_entries
-          
-        # save call log if new entries added
-        if no_entries_added > 0:
-            try:
-                with open(self.call_log_filename,'w') as out_file: 
-                    json.dump(old_log_entries, out_file, indent=1, sort_keys=True)
-            except IOError as e:
-                self.logger.error("Cannot write new call_log :" + str(e))
+            self.logger.error("Cannot write new call_log :" + str(e))
 
         # Report number of entries added to the local file
         yield GaugeMetricFamily(
@@ -0,0 +1,58 @@
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Stops scraping an unresponsive TG3442DE. After `failures` failed scrapes in a row the circuit opens
+    and no scrape is attempted for the backoff time. Then a single probe scrape is let through
+    (half open): success closes the circuit, failure opens it again with twice the backoff.
+    """
+
+    def __init__(self, failures: int, backoff: float, max_backoff: float):
+        """
+        :param failures: failed scrapes in a row opening the circuit, 0 to never open it
+        :param backoff: seconds the circuit stays open the first time
+        :param max_backoff: upper bound of the doubled backoff
+        """
+        self.failures = failures
+        self.initial_backoff = backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.backoff = backoff
+        self.opened_at = None
+
+    def allow(self) -> bool:
+        """
+        :return: whether a scrape may contact the TG3442DE
+        """
+        with self._lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.backoff:
+                self.state = HALF_OPEN
+                return True
+            return self.state == CLOSED
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.backoff = self.initial_backoff
+
+    def failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN:
+                self.backoff = min(self.backoff * 2, self.max_backoff)
+                self._open()
+            elif self.failures and self.consecutive_failures >= self.failures:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.time()
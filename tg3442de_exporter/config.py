@@ -1,3 +1,5 @@
+import copy
+import os
 from pathlib import Path
 from typing import Union, Dict
 
@@ -14,6 +16,8 @@ from tg3442de_exporter.event_log_local_extractor import EVENT_LOG_LOCAL
 
 IP_ADDRESS      = "ip_address"
 PASSWORD        = "password"
+TARGETS         = "targets"
+TARGET_NAME     = "name"
 EXPORTER        = "exporter"
 PORT            = "port"
 TIMEOUT_SECONDS = "timeout_seconds"
@@ -21,6 +25,40 @@ EXTRACTORS      = "metrics"
 CALL_LOG_FILE   = 'call_log_filename'
 EVENT_LOG_FILE  = 'event_log_filename'
 SIMULATE        = "simulate"
+KEEP_SESSION    = "keep_session"
+POLL_INTERVAL   = "poll_interval_seconds"
+EXTRACTOR_INTERVALS = "metric_intervals"
+FETCH_CONCURRENCY = "fetch_concurrency"
+ASYNC_CLIENT    = "async_client"
+MAX_CONCURRENT_TARGETS = "max_concurrent_targets"
+LOG_MAX_AGE_DAYS = "log_max_age_days"
+LOG_MAX_ENTRIES = "log_max_entries"
+LOG_MAX_BYTES   = "log_max_bytes"
+LOG_SEGMENT_BYTES = "log_segment_bytes"
+LOG_COMPACTION_INTERVAL = "log_compaction_interval_seconds"
+DOCSIS_SAMPLE_INTERVAL = "docsis_sample_interval_seconds"
+DOCSIS_SAMPLE_WINDOW = "docsis_sample_window"
+DOCSIS_THRESHOLDS = "docsis_thresholds"
+OVERVIEW_DEVICES = "overview_devices"
+COALESCE_MAX_WAIT = "coalesce_max_wait_seconds"
+SCRAPE_DEADLINE = "scrape_deadline_seconds"
+ADAPTIVE_TIMEOUT = "adaptive_timeout"
+BREAKER_FAILURES = "circuit_breaker_failures"
+BREAKER_BACKOFF = "circuit_breaker_backoff_seconds"
+BREAKER_MAX_BACKOFF = "circuit_breaker_max_backoff_seconds"
+OPENMETRICS     = "openmetrics_endpoint"
+DEBUG_ENDPOINTS = "debug_endpoints"
+LOG_ENDPOINTS   = "log_endpoints"
+SCRAPE_HISTORY  = "debug_scrape_history"
+
+# limits of DOCSIS channels in spec, following the usual cable operator recommendations
+DOCSIS_THRESHOLD_DEFAULTS = {
+    "downstream_power_level_min": -4.0,
+    "downstream_power_level_max": 13.0,
+    "downstream_snr_min": 33.0,
+    "upstream_power_level_min": 35.0,
+    "upstream_power_level_max": 51.0,
+}
 
 # pick default timeout one second less than the default prometheus timeout of 10s
 DEFAULT_CONFIG = {
@@ -30,11 +68,45 @@ DEFAULT_CONFIG = {
         # EXTRACTORS: {DEVICE_STATUS, DOCSIS_STATUS, OVERVIEW_STATUS, PHONE_STATUS, CALL_LOG, CALL_LOG_LOCAL, EVENT_LOG_LOCAL },
         EXTRACTORS: {DEVICE_STATUS, DOCSIS_STATUS, OVERVIEW_STATUS, PHONE_STATUS },
         SIMULATE : 0,
+        KEEP_SESSION : 0,
+        POLL_INTERVAL : 0,
+        EXTRACTOR_INTERVALS : {},
+        FETCH_CONCURRENCY : 1,
+        ASYNC_CLIENT : 0,
+        MAX_CONCURRENT_TARGETS : 8,
+        COALESCE_MAX_WAIT : 10,
+        SCRAPE_DEADLINE : 0,
+        ADAPTIVE_TIMEOUT : 0,
+        BREAKER_FAILURES : 0,
+        BREAKER_BACKOFF : 30,
+        BREAKER_MAX_BACKOFF : 600,
+        OPENMETRICS : 0,
+        DEBUG_ENDPOINTS : 0,
+        LOG_ENDPOINTS : 0,
+        SCRAPE_HISTORY : 20,
         CALL_LOG_FILE : 'tg3442de_call_log.json',
         EVENT_LOG_FILE : 'tg3442de_event_log.json',
+        LOG_MAX_AGE_DAYS : 0,
+        LOG_MAX_ENTRIES : 0,
+        LOG_MAX_BYTES : 0,
+        LOG_SEGMENT_BYTES : 1048576,
+        LOG_COMPACTION_INTERVAL : 3600,
+        DOCSIS_SAMPLE_INTERVAL : 0,
+        DOCSIS_SAMPLE_WINDOW : 60,
+        DOCSIS_THRESHOLDS : dict(DOCSIS_THRESHOLD_DEFAULTS),
+        # cardinality policy of the per-device series of overview_status, the defaults keep all of them
+        OVERVIEW_DEVICES : {
+            "labels": ['index', 'hostname', 'MAC', 'IPv4', 'IPv6'],
+            "top_n": 0,
+            "max_devices": 0,
+            "expiry_seconds": 0,
+        },
     }
 }
 
+# merges user config into defaults: 'override' for lists to let users replace extractor setting entirely
+MERGER = Merger([(list, "override"), (dict, "merge")], ["override"], ["override"])
+
 
 def load_config(config_file: Union[str, Path]) -> Dict:
     """
@@ -46,26 +118,109 @@ def load_config(config_file: Union[str, Path]) -> Dict:
     with open(config_file) as f:
         config = yaml.load(f)
 
-    # merge with default config: use 'override' for lists to let users replace extractor setting entirely
-    merger = Merger([(list, "override"), (dict, "merge")], ["override"], ["override"])
-    config = merger.merge(DEFAULT_CONFIG, config)
+    # merge with default config
+    config = MERGER.merge(DEFAULT_CONFIG, config)
 
-    for param in [IP_ADDRESS, PASSWORD]:
-        if not param in config:
-            raise ValueError(
-                f"'{param}' is a mandatory config parameter, but it is missing in the YAML configuration file. Please see README.md for an example."
-            )
+    # either a single TG3442DE or a list of targets has to be given
+    if TARGETS in config:
+        names = set()
+        for target in config[TARGETS]:
+            for param in [IP_ADDRESS, PASSWORD]:
+                if not param in target:
+                    raise ValueError(
+                        f"'{param}' is a mandatory parameter of each entry in '{TARGETS}'. Please see README.md for an example."
+                    )
+            target.setdefault(TARGET_NAME, target[IP_ADDRESS])
+            if target[TARGET_NAME] in names:
+                raise ValueError(f"Target name '{target[TARGET_NAME]}' is used more than once.")
+            names.add(target[TARGET_NAME])
+        if not names:
+            raise ValueError(f"'{TARGETS}' needs to specify at least one TG3442DE.")
+    else:
+        for param in [IP_ADDRESS, PASSWORD]:
+            if not param in config:
+                raise ValueError(
+                    f"'{param}' is a mandatory config parameter, but it is missing in the YAML configuration file. Please see README.md for an example."
+                )
 
     if EXPORTER in config.keys():
-        if config[EXPORTER][TIMEOUT_SECONDS] <= 0:
-            raise ValueError(f"'{TIMEOUT_SECONDS} must be positive.")
-        if config[EXPORTER][PORT] < 0 or config[EXPORTER][PORT] > 65535:
-            raise ValueError(f"Invalid exporter port.")
-
-        if not config[EXPORTER][EXTRACTORS]:
-            raise ValueError(
-                "The config file needs to specify at least one family of metrics."
-            )
-        config[EXPORTER][EXTRACTORS] = sorted(set(config[EXPORTER][EXTRACTORS]))
+        validate_exporter_config(config[EXPORTER])
 
     return config
+
+
+def validate_exporter_config(exporter_config: Dict):
+    """
+    Validates the exporter section of the config, merged with the defaults
+    :param exporter_config: exporter section
+    :raises: ValueError
+    """
+    if exporter_config[TIMEOUT_SECONDS] <= 0:
+        raise ValueError(f"'{TIMEOUT_SECONDS} must be positive.")
+    if exporter_config[POLL_INTERVAL] < 0:
+        raise ValueError(f"'{POLL_INTERVAL}' must not be negative.")
+    if exporter_config[FETCH_CONCURRENCY] < 1:
+        raise ValueError(f"'{FETCH_CONCURRENCY}' must be at least 1.")
+    if exporter_config[COALESCE_MAX_WAIT] <= 0:
+        raise ValueError(f"'{COALESCE_MAX_WAIT}' must be positive.")
+    for param in [SCRAPE_DEADLINE, BREAKER_FAILURES]:
+        if exporter_config[param] < 0:
+            raise ValueError(f"'{param}' must not be negative.")
+    if exporter_config[BREAKER_BACKOFF] <= 0:
+        raise ValueError(f"'{BREAKER_BACKOFF}' must be positive.")
+    if exporter_config[BREAKER_MAX_BACKOFF] < exporter_config[BREAKER_BACKOFF]:
+        raise ValueError(f"'{BREAKER_MAX_BACKOFF}' must not be less than '{BREAKER_BACKOFF}'.")
+    if exporter_config[SCRAPE_HISTORY] < 1:
+        raise ValueError(f"'{SCRAPE_HISTORY}' must be at least 1.")
+    if exporter_config[MAX_CONCURRENT_TARGETS] < 1:
+        raise ValueError(f"'{MAX_CONCURRENT_TARGETS}' must be at least 1.")
+    for param in [LOG_MAX_AGE_DAYS, LOG_MAX_ENTRIES, LOG_MAX_BYTES, LOG_COMPACTION_INTERVAL]:
+        if exporter_config[param] < 0:
+            raise ValueError(f"'{param}' must not be negative.")
+    if exporter_config[DOCSIS_SAMPLE_INTERVAL] < 0:
+        raise ValueError(f"'{DOCSIS_SAMPLE_INTERVAL}' must not be negative.")
+    if exporter_config[DOCSIS_SAMPLE_INTERVAL] > 0 and exporter_config[KEEP_SESSION] != 1:
+        # the web interface allows one admin session, logins of the sampler would log out scrapes
+        raise ValueError(f"'{DOCSIS_SAMPLE_INTERVAL}' requires '{KEEP_SESSION}: 1'.")
+    if exporter_config[DOCSIS_SAMPLE_WINDOW] < 1:
+        raise ValueError(f"'{DOCSIS_SAMPLE_WINDOW}' must be at least 1.")
+    for threshold in exporter_config[DOCSIS_THRESHOLDS]:
+        if threshold not in DOCSIS_THRESHOLD_DEFAULTS:
+            raise ValueError(f"Unknown threshold '{threshold}' in '{DOCSIS_THRESHOLDS}'.")
+    for param in ["top_n", "max_devices", "expiry_seconds"]:
+        if exporter_config[OVERVIEW_DEVICES][param] < 0:
+            raise ValueError(f"'{param}' in '{OVERVIEW_DEVICES}' must not be negative.")
+    if exporter_config[LOG_SEGMENT_BYTES] < 1:
+        raise ValueError(f"'{LOG_SEGMENT_BYTES}' must be positive.")
+    if exporter_config[PORT] < 0 or exporter_config[PORT] > 65535:
+        raise ValueError(f"Invalid exporter port.")
+
+    if not exporter_config[EXTRACTORS]:
+        raise ValueError(
+            "The config file needs to specify at least one family of metrics."
+        )
+    exporter_config[EXTRACTORS] = sorted(set(exporter_config[EXTRACTORS]))
+
+    for extractor, interval in exporter_config[EXTRACTOR_INTERVALS].items():
+        if interval < 0:
+            raise ValueError(f"Interval of '{extractor}' in '{EXTRACTOR_INTERVALS}' must not be negative.")
+
+
+def target_exporter_config(config: Dict, target: Dict) -> Dict:
+    """
+    Exporter config of one entry in 'targets': the global exporter config, overridden by the target's
+    own 'exporter' section. Local log files are prefixed with the target name unless set explicitly.
+    :param config: config as returned by load_config
+    :param target: entry of config['targets']
+    :return: exporter config for this target
+    """
+    exporter_config = copy.deepcopy(dict(config[EXPORTER]))
+    own_config = target.get(EXPORTER) or {}
+    for filename in [CALL_LOG_FILE, EVENT_LOG_FILE]:
+        if filename not in own_config:
+            directory, basename = os.path.split(exporter_config[filename])
+            exporter_config[filename] = os.path.join(directory, f"{target[TARGET_NAME]}_{basename}")
+    # nested sections like 'docsis_thresholds' are merged, not replaced
+    exporter_config = MERGER.merge(exporter_config, copy.deepcopy(dict(own_config)))
+    validate_exporter_config(exporter_config)
+    return exporter_config
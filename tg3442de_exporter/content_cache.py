@@ -0,0 +1,71 @@
+import hashlib
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from prometheus_client import Metric
+from prometheus_client.metrics_core import CounterMetricFamily
+
+
+def content_digest(raw_html: str) -> bytes:
+    """
+    Hash of a page content
+    """
+    return hashlib.blake2b(raw_html.encode("utf-8"), digest_size=16).digest()
+
+
+class ContentCache:
+    """
+    Metric families of each extractor together with the hashes of the pages they were built from.
+    As long as the TG3442DE serves the same content, the families are reused instead of parsing the pages again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (page hashes by page, metric families) by extractor name
+        self._entries = {}  # type: Dict[str, tuple]
+        self.hits = Counter()  # type: Counter
+        self.misses = Counter()  # type: Counter
+
+    def lookup(self, name: str, digests: Dict[str, bytes]) -> Optional[List[Metric]]:
+        """
+        Returns the families of the extractor if all its pages are unchanged, None otherwise
+        :param name: extractor name
+        :param digests: hashes of the pages just fetched, by page
+        """
+        with self._lock:
+            entry = self._entries.get(name)
+            cached_digests = entry[0] if entry is not None else {}
+            for page, digest in digests.items():
+                if cached_digests.get(page) == digest:
+                    self.hits[page] += 1
+                else:
+                    self.misses[page] += 1
+            if entry is not None and cached_digests == digests:
+                return entry[1]
+            return None
+
+    def store(self, name: str, digests: Dict[str, bytes], families: List[Metric]):
+        with self._lock:
+            self._entries[name] = (digests, families)
+
+    def metrics(self) -> Iterable[Metric]:
+        with self._lock:
+            hits = dict(self.hits)
+            misses = dict(self.misses)
+        hits_metric = CounterMetricFamily(
+            "tg3442de_content_cache_hits",
+            "Number of pages whose content did not change since the last extraction",
+            labels=["page"],
+        )
+        for page, count in hits.items():
+            hits_metric.add_metric([page], count)
+        yield hits_metric
+        misses_metric = CounterMetricFamily(
+            "tg3442de_content_cache_misses",
+            "Number of pages extracted because their content changed",
+            labels=["page"],
+        )
+        for page, count in misses.items():
+            misses_metric.add_metric([page], count)
+        yield misses_metric
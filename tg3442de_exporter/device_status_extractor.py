@@ -1,3 +1,4 @@
+import re
 from logging import Logger
 from typing import Iterable, Set, Dict
 
@@ -29,12 +30,13 @@ class DeviceStatusExtractor(HtmlMetricsExtractor):
         if len(raw_html) < 10:
             return
 
+        js_vars = self.js_vars(raw_html)
         #var js_SerialNumber = 'XXXXXXXXXXX';
-        serial_number = self.re_search(r".*var js_SerialNumber = '(.*)';.*",raw_html,1)[0]
+        serial_number = js_vars.get('js_SerialNumber', 'Unknown')
         #var js_FWVersion = 'AR01.04.046.17_060822_7244.SIP.10.X1';
-        firmware_version = self.re_search(r".*var js_FWVersion = '(.*)';.*",raw_html,1)[0]
+        firmware_version = js_vars.get('js_FWVersion', 'Unknown')
         #var js_HWTypeVersion = '7';
-        hardware_version  = self.re_search(r".*var js_HWTypeVersion = '(.*)';.*",raw_html,1)[0]
+        hardware_version  = js_vars.get('js_HWTypeVersion', 'Unknown')
 
         yield InfoMetricFamily(
             'tg3442de_device',
@@ -47,7 +49,8 @@ class DeviceStatusExtractor(HtmlMetricsExtractor):
         )
 
         #var js_UptimeSinceReboot = '32,00,59';
-        uptime = self.re_search(r".*var js_UptimeSinceReboot = '(\d+),(\d+),(\d+)';.*",raw_html,3,default=0)
+        uptime = re.fullmatch(r"(\d+),(\d+),(\d+)", js_vars.get('js_UptimeSinceReboot', ''))
+        uptime = uptime.groups() if uptime is not None else [0]*3
         uptime_seconds = int(uptime[0])*86400 + int(uptime[1])*3600 + int(uptime[2])*60
 
         yield GaugeMetricFamily(
@@ -0,0 +1,205 @@
+import json
+import math
+import threading
+import time
+import traceback
+from array import array
+from logging import Logger
+from typing import Dict, Iterable, Optional
+
+from prometheus_client import Metric
+from prometheus_client.metrics_core import GaugeMetricFamily
+
+from tg3442de_exporter.circuit_breaker import CircuitBreaker
+from tg3442de_exporter.docsis_status_extractor import DocsisChannel, DocsisStatusExtractor, GET_STATUS_DOCSIS
+from tg3442de_exporter.js_scanner import scan_js_vars
+
+
+class RingBuffer:
+    """
+    Fixed-size window of the latest samples, stored in a compact array
+    """
+    __slots__ = ["values", "size", "count", "position"]
+
+    def __init__(self, size: int, typecode: str = 'd'):
+        self.values = array(typecode, [0]) * size
+        self.size = size
+        self.count = 0
+        self.position = 0
+
+    def append(self, value):
+        self.values[self.position] = value
+        self.position = (self.position + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def window(self) -> array:
+        """
+        :return: samples in the window, oldest first
+        """
+        if self.count < self.size:
+            return self.values[:self.count]
+        return self.values[self.position:] + self.values[:self.position]
+
+    def stats(self) -> Dict[str, float]:
+        """
+        :return: min, max, avg and stddev of the window
+        """
+        window = self.window()
+        avg = math.fsum(window) / len(window)
+        stddev = math.sqrt(math.fsum((value - avg) ** 2 for value in window) / len(window))
+        return {"min": min(window), "max": max(window), "avg": avg, "stddev": stddev}
+
+    def changes(self) -> int:
+        """
+        :return: number of consecutive samples differing within the window
+        """
+        window = self.window()
+        return sum(1 for previous, current in zip(window, window[1:]) if previous != current)
+
+
+class ChannelHistory:
+    """
+    Sample windows of one DOCSIS channel
+    """
+    __slots__ = ["labels", "power_level", "snr", "locked"]
+
+    def __init__(self, labels: tuple, size: int):
+        self.labels = labels
+        self.power_level = RingBuffer(size)
+        self.snr = RingBuffer(size)
+        self.locked = RingBuffer(size, 'b')
+
+    def append(self, channel: DocsisChannel):
+        self.power_level.append(channel.power_level)
+        self.snr.append(channel.snr)
+        self.locked.append(channel.locked)
+
+
+class DocsisSampler:
+    """
+    Samples the DOCSIS page in a background thread, at a higher rate than Prometheus scrapes, and
+    exports statistics over the last `window` samples of every channel, so short dips are not missed.
+    """
+
+    def __init__(self, logger: Logger, session, extractor: DocsisStatusExtractor, interval: float, window: int,
+                 breaker: Optional[CircuitBreaker] = None):
+        """
+        :param logger: logging logger
+        :param session: TG3442DESession or AsyncTG3442DESession shared with the collector
+        :param extractor: DocsisStatusExtractor used to parse the channels
+        :param interval: seconds between samples
+        :param window: number of samples per channel
+        :param breaker: CircuitBreaker shared with the collector, no samples are taken while it is open
+        """
+        self.logger = logger
+        self.session = session
+        self.breaker = breaker
+        self.extractor = extractor
+        self.interval = interval
+        self.window = window
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # channel tables of the sampler, separate from those of the extractor's scrapes
+        self._tables = {"downstream": {}, "upstream": {}}  # type: Dict[str, Dict[str, DocsisChannel]]
+        self._histories = {"downstream": {}, "upstream": {}}  # type: Dict[str, Dict[str, ChannelHistory]]
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="tg3442de-docsis-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            pre_sample_time = time.time()
+            if self.breaker is None or self.breaker.allow():
+                try:
+                    self.sample()
+                except Exception:
+                    self.logger.error(f"DOCSIS sample failed.\n{traceback.format_exc()}")
+                    if self.breaker is not None:
+                        self.breaker.failure()
+                else:
+                    # samples may probe the half open circuit as well
+                    if self.breaker is not None:
+                        self.breaker.success()
+            elapsed = time.time() - pre_sample_time
+            self._stop.wait(max(self.interval - elapsed, 0))
+
+    def sample(self):
+        """
+        Fetches the DOCSIS page once and appends its values to the channel windows
+        """
+        box = self.session.acquire()
+        try:
+            raw_html = self.session.html_getter(box, GET_STATUS_DOCSIS)
+        except Exception:
+            self.session.invalidate()
+            raise
+        finally:
+            self.session.release(box)
+        if len(raw_html) < 10:
+            return
+
+        js_vars = scan_js_vars(raw_html)
+        channels_data = {
+            "downstream": json.loads(js_vars['json_dsData']),
+            "upstream": json.loads(js_vars['json_usData']),
+        }
+        with self._lock:
+            for direction, data in channels_data.items():
+                histories = self._histories[direction]
+                sampled = {}
+                channels = self.extractor.update_channels(self._tables[direction], data)
+                for channel in channels:
+                    channel_id = channel.labels[0]
+                    history = histories.get(channel_id)
+                    if history is None:
+                        history = ChannelHistory(channel.labels, self.window)
+                    history.append(channel)
+                    sampled[channel_id] = history
+                # channels gone from the page are dropped with their history
+                self._histories[direction] = sampled
+
+    def metrics(self) -> Iterable[Metric]:
+        CHANNEL_ID = 'channel_id'
+        STAT = 'stat'
+        with self._lock:
+            for direction in ["downstream", "upstream"]:
+                histories = list(self._histories[direction].values())
+                power_level = GaugeMetricFamily(
+                    f"tg3442de_{direction}_power_level_window",
+                    f"{direction.capitalize()} channel power level over the sample window",
+                    unit="dbmV",
+                    labels=[CHANNEL_ID, STAT],
+                )
+                snr = GaugeMetricFamily(
+                    f"tg3442de_{direction}_snr_window",
+                    f"{direction.capitalize()} channel signal-to-noise ratio (SNR) over the sample window",
+                    unit="db",
+                    labels=[CHANNEL_ID, STAT],
+                )
+                lock_flaps = GaugeMetricFamily(
+                    f"tg3442de_{direction}_lock_flaps",
+                    f"Number of {direction} locking status changes within the sample window",
+                    labels=[CHANNEL_ID],
+                )
+                for history in histories:
+                    for stat, value in history.power_level.stats().items():
+                        power_level.add_metric(history.labels + (stat,), value)
+                    if direction == "downstream":
+                        for stat, value in history.snr.stats().items():
+                            snr.add_metric(history.labels + (stat,), value)
+                    lock_flaps.add_metric(history.labels, history.locked.changes())
+                yield power_level
+                if direction == "downstream":
+                    yield snr
+                yield lock_flaps
@@ -1,9 +1,10 @@
 from operator import truediv
-import re
-import json
+import math
+import sys
+from array import array
 from enum import Enum
 from logging import Logger
-from typing import Iterable, Set, Dict
+from typing import Iterable, Set, Dict, List
 
 from tg3442de_exporter.html_metrics_extractor import HtmlMetricsExtractor
 
@@ -41,30 +42,125 @@ class LockStatus(Enum):
     LOCKED   = True
     UNLOCKED = False
 
+# lookup tables instead of Enum construction with exception-based fallback
+CHANNEL_TYPES = {channel_type.value: channel_type.value for channel_type in ChannelType}
+CHANNEL_MODULATIONS = {modulation.value: modulation.value for modulation in ChannelModulation}
+LOCKED_STATUSES = frozenset(["ACTIVE", "Locked", "SUCCESS"])
+
+
+class DocsisChannel:
+    """
+    Row of the persistent channel table of DocsisStatusExtractor. Labels are resolved once per channel
+    and only again if the TG3442DE reports another type or modulation for it.
+    """
+    __slots__ = ["raw_type", "raw_modulation", "labels", "labels_full", "locked", "frequency", "power_level", "snr"]
+
+    def __init__(self):
+        self.raw_type = None
+        self.raw_modulation = None
+        self.labels = ()
+        self.labels_full = ()
+        self.locked = 0
+        self.frequency = 0.0
+        self.power_level = 0.0
+        self.snr = 0.0
+
+
+class ChannelColumns:
+    """
+    Values of all channels of one channel type as column arrays
+    """
+    __slots__ = ["frequency", "power_level", "snr", "locked"]
+
+    def __init__(self):
+        self.frequency = array('d')
+        self.power_level = array('d')
+        self.snr = array('d')
+        self.locked = array('b')
+
+
+def channel_columns(channels: Iterable[DocsisChannel]) -> Dict[str, ChannelColumns]:
+    """
+    Splits channels into column arrays by channel type in a single pass
+    """
+    columns = {}  # type: Dict[str, ChannelColumns]
+    for channel in channels:
+        channel_type = channel.labels_full[1]
+        type_columns = columns.get(channel_type)
+        if type_columns is None:
+            type_columns = columns[channel_type] = ChannelColumns()
+        type_columns.frequency.append(channel.frequency)
+        type_columns.power_level.append(channel.power_level)
+        type_columns.snr.append(channel.snr)
+        type_columns.locked.append(channel.locked)
+    return columns
+
+
 class DocsisStatusExtractor(HtmlMetricsExtractor):
     def __init__(self, logger: Logger, exporter_config: Dict):
         super(DocsisStatusExtractor, self).__init__(
             DOCSIS_STATUS, {GET_STATUS_DOCSIS}, logger
         )
         self.logger = logger
+        # channel tables by ChannelID
+        self.downstream_channels = {}  # type: Dict[str, DocsisChannel]
+        self.upstream_channels = {}  # type: Dict[str, DocsisChannel]
+        # limits for counting channels out of spec
+        self.thresholds = exporter_config['docsis_thresholds']
 
     def get_channel_modulation(self,modulation):
-        try:
-            enum_channel_modulation = ChannelModulation(modulation)
-        except ValueError:
+        channel_modulation = CHANNEL_MODULATIONS.get(modulation)
+        if channel_modulation is None:
             self._logger.warning(f"Unknown channel modulation '{modulation}'.")
-            enum_channel_modulation = ChannelModulation.UNKNOWN
-        return enum_channel_modulation.value
+            channel_modulation = ChannelModulation.UNKNOWN.value
+        return channel_modulation
 
     def get_channel_type(self,channel_type):
-        try:
-            enum_channel_type = ChannelType(channel_type)
-        except ValueError:
-            self._logger.warning(f"Unknown channel modulation '{channel_type}'.")
-            enum_channel_type = ChannelType.UNKNOWN
+        resolved_channel_type = CHANNEL_TYPES.get(channel_type)
+        if resolved_channel_type is None:
+            self._logger.warning(f"Unknown channel type '{channel_type}'.")
+            resolved_channel_type = ChannelType.UNKNOWN.value
+        return resolved_channel_type
 
-        return enum_channel_type.value
+    def update_channels(self, table: Dict[str, DocsisChannel], channels_data: List[Dict]) -> List[DocsisChannel]:
+        """
+        Updates the channel table in place from the channels reported by the TG3442DE
+        :param table: channel table by ChannelID, channels not reported anymore are removed
+        :param channels_data: channels as parsed from the page
+        :return: reported channels in page order
+        """
+        channels = []
+        reported = {}
+        for channel_data in channels_data:
+            channel_id = channel_data["ChannelID"]
+            channel = table.get(channel_id)
+            if channel is None:
+                channel = DocsisChannel()
+                channel.labels = (sys.intern(channel_id.zfill(2)),)
+            raw_type = channel_data['ChannelType']
+            raw_modulation = channel_data['Modulation']
+            if raw_type != channel.raw_type or raw_modulation != channel.raw_modulation:
+                channel.raw_type = raw_type
+                channel.raw_modulation = raw_modulation
+                channel.labels_full = channel.labels + (
+                    self.get_channel_type(raw_type), self.get_channel_modulation(raw_modulation)
+                )
+
+            channel.locked = 1 if channel_data['LockStatus'] in LOCKED_STATUSES else 0
+            frequency = channel_data["Frequency"]
+            if type(frequency) is str:
+                frequency = frequency.split('~')[0]
+            channel.frequency = float(frequency)
+            power_level_mV, _, power_level_uV = channel_data["PowerLevel"].partition('/')
+            channel.power_level = float(power_level_mV)
+            snr_level = channel_data.get("SNRLevel")
+            channel.snr = float(snr_level) if snr_level is not None else 0.0
 
+            reported[channel_id] = channel
+            channels.append(channel)
+        table.clear()
+        table.update(reported)
+        return channels
 
     def extract(self, raw_htmls: Dict[str, bytes]) -> Iterable[Metric]:
         self.logger.debug("DeviceStatusExtractor")
@@ -75,19 +171,15 @@ class DocsisStatusExtractor(HtmlMetricsExtractor):
             return
 
         # extract json from javascript
-        json_downstream_data = re.search(r".*json_dsData = (.+);.*", raw_html)[1]
-        json_upstream_data = re.search(r".*json_usData = (.+);.*", raw_html)[1]
+        js_vars = self.js_vars(raw_html)
+        json_downstream_data = js_vars['json_dsData']
+        json_upstream_data = js_vars['json_usData']
         # parse json
-        downstream_data = json.loads(json_downstream_data)
-        upstream_data = json.loads(json_upstream_data)
-        # convert lock status to numeric values
-        for d in [ upstream_data, downstream_data ]:
-            for c in d:
-                if c['LockStatus'] == "ACTIVE" or c['LockStatus'] == "Locked" or c['LockStatus'] == "SUCCESS":
-                    c['LockStatus'] = 1
-                else:
-                    c['LockStatus'] = 0
-        
+        downstream_data = self.json_loads(json_downstream_data)
+        upstream_data = self.json_loads(json_upstream_data)
+        downstream_channels = self.update_channels(self.downstream_channels, downstream_data)
+        upstream_channels = self.update_channels(self.upstream_channels, upstream_data)
+
         CHANNEL_ID = 'channel_id'
         CHANNEL_TYPE = 'channel_type'
         CHANNEL_MODULATION = 'channel_modulation'
@@ -114,24 +206,13 @@ class DocsisStatusExtractor(HtmlMetricsExtractor):
             "Downstream locking status",
             labels=[CHANNEL_ID],
         )
-        for channel in downstream_data:
-            channel_id = channel["ChannelID"]
-            channel_type = self.get_channel_type(channel['ChannelType'])
-            channel_modulation = self.get_channel_modulation(channel['Modulation'])
-            lock_status = channel['LockStatus']
-            frequency = channel["Frequency"]
-            if type(frequency) is str:
-                frequency = frequency.split('~')[0]
-            power_level_mV,power_level_uV = channel["PowerLevel"].split('/')
-            snr_level = channel["SNRLevel"]
-
-            labels = [channel_id.zfill(2)]
-            labels_full = labels + [channel_type, channel_modulation]
-            ds_locked.add_metric(labels,lock_status)
-            ds_frequency.add_metric(labels_full, float(frequency))
-            ds_power_level.add_metric(labels_full, float(power_level_mV))
-            ds_snr.add_metric(labels_full, float(snr_level))
+        for channel in downstream_channels:
+            ds_locked.add_metric(channel.labels, channel.locked)
+            ds_frequency.add_metric(channel.labels_full, channel.frequency)
+            ds_power_level.add_metric(channel.labels_full, channel.power_level)
+            ds_snr.add_metric(channel.labels_full, channel.snr)
         yield from [ds_frequency, ds_power_level, ds_snr, ds_locked]
+        yield from self.aggregates("downstream", downstream_channels)
 
         us_frequency = GaugeMetricFamily(
             "tg3442de_upstream_frequency",
@@ -151,20 +232,78 @@ class DocsisStatusExtractor(HtmlMetricsExtractor):
             labels=[CHANNEL_ID],
         )
 
-        for channel in upstream_data:
-            channel_id = channel["ChannelID"]
-            channel_type = self.get_channel_type(channel['ChannelType'])
-            channel_modulation = self.get_channel_modulation(channel['Modulation'])
-            lock_status = channel['LockStatus']
-            frequency = channel["Frequency"]
-            if type(frequency) is str:
-                frequency = frequency.split('~')[0]
-            power_level_mV,power_level_uV = channel["PowerLevel"].split('/')
-
-            labels = [channel_id.zfill(2)]
-            labels_full = labels + [channel_type, channel_modulation]
-            us_locked.add_metric(labels,lock_status)
-            us_frequency.add_metric(labels_full, float(frequency))
-            us_power_level.add_metric(labels_full, float(power_level_mV))
+        for channel in upstream_channels:
+            us_locked.add_metric(channel.labels, channel.locked)
+            us_frequency.add_metric(channel.labels_full, channel.frequency)
+            us_power_level.add_metric(channel.labels_full, channel.power_level)
         yield from [us_frequency, us_power_level,us_locked]
+        yield from self.aggregates("upstream", upstream_channels)
+
+    def aggregates(self, direction: str, channels: List[DocsisChannel]) -> Iterable[Metric]:
+        """
+        Line quality aggregated by channel type
+        :param direction: 'downstream' or 'upstream'
+        :param channels: channels as returned by update_channels
+        """
+        CHANNEL_TYPE = 'channel_type'
+        power_level_min = self.thresholds[f"{direction}_power_level_min"]
+        power_level_max = self.thresholds[f"{direction}_power_level_max"]
+        snr_min = self.thresholds.get(f"{direction}_snr_min")
+
+        channel_count = GaugeMetricFamily(
+            f"tg3442de_{direction}_channels",
+            f"Number of {direction} channels by channel type",
+            labels=[CHANNEL_TYPE],
+        )
+        locked_count = GaugeMetricFamily(
+            f"tg3442de_{direction}_locked_channels",
+            f"Number of locked {direction} channels by channel type",
+            labels=[CHANNEL_TYPE],
+        )
+        power_level_spread = GaugeMetricFamily(
+            f"tg3442de_{direction}_power_level_spread",
+            f"Difference between highest and lowest {direction} channel power level by channel type",
+            unit="dbmV",
+            labels=[CHANNEL_TYPE],
+        )
+        out_of_spec = GaugeMetricFamily(
+            f"tg3442de_{direction}_channels_out_of_spec",
+            f"Number of {direction} channels unlocked or outside the power level"
+            + (" or SNR" if snr_min is not None else "") + " thresholds by channel type",
+            labels=[CHANNEL_TYPE],
+        )
+        snr_min_metric = GaugeMetricFamily(
+            f"tg3442de_{direction}_snr_min",
+            f"Lowest {direction} channel signal-to-noise ratio (SNR) by channel type",
+            unit="db",
+            labels=[CHANNEL_TYPE],
+        )
+        snr_mean_metric = GaugeMetricFamily(
+            f"tg3442de_{direction}_snr_mean",
+            f"Mean {direction} channel signal-to-noise ratio (SNR) by channel type",
+            unit="db",
+            labels=[CHANNEL_TYPE],
+        )
+
+        for channel_type, columns in channel_columns(channels).items():
+            labels = [channel_type]
+            channel_count.add_metric(labels, len(columns.locked))
+            locked_count.add_metric(labels, sum(columns.locked))
+            power_level_spread.add_metric(labels, max(columns.power_level) - min(columns.power_level))
+            if snr_min is None:
+                out_of_spec_count = sum(
+                    1 for power_level, locked in zip(columns.power_level, columns.locked)
+                    if not locked or not power_level_min <= power_level <= power_level_max
+                )
+            else:
+                out_of_spec_count = sum(
+                    1 for power_level, snr, locked in zip(columns.power_level, columns.snr, columns.locked)
+                    if not locked or not power_level_min <= power_level <= power_level_max or snr < snr_min
+                )
+                snr_min_metric.add_metric(labels, min(columns.snr))
+                snr_mean_metric.add_metric(labels, math.fsum(columns.snr) / len(columns.snr))
+            out_of_spec.add_metric(labels, out_of_spec_count)
 
+        yield from [channel_count, locked_count, power_level_spread, out_of_spec]
+        if snr_min is not None:
+            yield from [snr_min_metric, snr_mean_metric]
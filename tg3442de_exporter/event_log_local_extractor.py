@@ -1,10 +1,16 @@
-from logging import Logger
-from typing import Iterable, Set, Dict
 import json
+import os
+from logging import Logger
+from collections import Counter
+from typing import Iterable, Set, Dict, List, Optional
+import re
+from datetime import datetime
 
 from tg3442de_exporter.html_metrics_extractor import HtmlMetricsExtractor
+from tg3442de_exporter.log_store import LogStore, log_retention
 from prometheus_client import Metric
 from prometheus_client.metrics_core import (
+    CounterMetricFamily,
     GaugeMetricFamily,
 )
 
@@ -12,60 +18,152 @@ from prometheus_client.metrics_core import (
 EVENT_LOG_LOCAL = 'event_log_local'
 GET_EVENT_LOG_LOCAL = '/php/status_event_log_data.php?{%22eventLogRecord%22:{}}'
 
+EVENT_TIMESTAMP_FORMATS = ['%d/%m/%Y %H:%M:%S', '%d.%m.%Y %H:%M:%S', '%Y-%m-%d %H:%M:%S']
+
+
+# event types by pattern of the message, the first matching pattern wins
+EVENT_TYPES = [
+    ('t3_timeout', re.compile(r'T3 time-?out', re.IGNORECASE)),
+    ('t4_timeout', re.compile(r'T4 time-?out', re.IGNORECASE)),
+    ('ranging_failure', re.compile(r'Ranging|RNG-RSP', re.IGNORECASE)),
+    ('sync_loss', re.compile(r'SYNC Timing|Synchroni[sz]ation|Loss of Sync|Lost MDD', re.IGNORECASE)),
+    ('reboot', re.compile(r'Reboot|Cold Start|Reset', re.IGNORECASE)),
+]
+EVENT_TYPE_OTHER = 'other'
+
+
+def event_type_of(message: str) -> str:
+    """
+    Event type of an event log message, 'other' if no pattern of EVENT_TYPES matches
+    """
+    for event_type, pattern in EVENT_TYPES:
+        if pattern.search(message):
+            return event_type
+    return EVENT_TYPE_OTHER
+
+
+def event_timestamp(key: str, log_entry: Dict) -> Optional[float]:
+    """
+    Unix timestamp of an event log entry, None if the format of 'Timestamp' is unknown
+    """
+    timestamp = str(log_entry.get('Timestamp', ''))
+    try:
+        return float(timestamp)
+    except ValueError:
+        pass
+    for timestamp_format in EVENT_TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(timestamp, timestamp_format).timestamp()
+        except ValueError:
+            pass
+    return None
+
 
 class EventLogLocalExtractor(HtmlMetricsExtractor):
+    # metrics depend on the local store, not only on the page content
+    cacheable = False
+
     def __init__(self, logger: Logger, exporter_config: Dict):
         super(EventLogLocalExtractor, self).__init__(
             EVENT_LOG_LOCAL, {GET_EVENT_LOG_LOCAL}, logger
         )
         self.logger = logger
         self.event_log_filename = exporter_config['event_log_filename']
+        self.store = LogStore(self.event_log_filename, logger, event_timestamp, log_retention(exporter_config))
 
-    def extract(self, raw_htmls: Dict[str, bytes]) -> Iterable[Metric]:
-        self.logger.debug("EventLogLocal")
+        # counts of stored entries by (event type, priority). They are kept in <filename>.counts, as
+        # retention drops entries from the store and the counters must not decrease after a restart.
+        self.counts_filename = self.event_log_filename + ".counts"
+        self.event_counts = self._read_event_counts()
+        if self.event_counts is None:
+            # first start, count the stored history once
+            self.event_counts = Counter()
+            for key, log_entry in self.store.entries():
+                self.count_event(log_entry)
+            self._write_event_counts()
 
-        # parse Event Log
-        raw_html = raw_htmls[GET_EVENT_LOG_LOCAL]
-        if len(raw_html) < 10:
-            return
-        # parse json
-        json_event_log_dat = json.loads(raw_html)
-
-        event_log_record = json_event_log_dat['eventLog']
-        no_entries = len(event_log_record)
-        if no_entries == 0:
-            return
-        no_entries_added = 0
-        log_entries = {}
-        for log_entry in event_log_record:    
-            key = "{}-{}".format(log_entry['Timestamp'],log_entry['Index'])
-            log_entries[key] = log_entry
+    def _read_event_counts(self) -> Optional[Counter]:
+        try:
+            with open(self.counts_filename) as f:
+                return Counter({
+                    (count['type'], count['priority']): count['count'] for count in json.load(f)
+                })
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError, TypeError):
+            self.logger.warning(f"Ignoring invalid event counts in {self.counts_filename}")
+            return None
 
-        # TODO: For large event logs work on files directly and not in memory
-        # read stored event log
-        old_log_entries = {}
+    def _write_event_counts(self):
+        counts = [
+            {'type': event_type, 'priority': priority, 'count': count}
+            for (event_type, priority), count in sorted(self.event_counts.items())
+        ]
         try:
-            with open(self.event_log_filename,'r') as in_file: 
-              old_log_entries = json.load(in_file)
+            with open(self.counts_filename + ".tmp", "w") as f:
+                json.dump(counts, f)
+            os.replace(self.counts_filename + ".tmp", self.counts_filename)
         except IOError as e:
-            self.logger.info("Cannot read old event_log :" +str(e))
-        no_old_entries = len(old_log_entries)
+            self.logger.error("Cannot write event counts :" + str(e))
+
+    def count_event(self, log_entry: Dict):
+        event_type = event_type_of(log_entry.get('Message', ''))
+        self.event_counts[(event_type, str(log_entry.get('Priority', '')))] += 1
+
+    def store_new_entries(self, event_log_record: List[Dict]) -> int:
+        """
+        Appends the entries not stored yet and counts them
+        :return: number of entries added
+        """
+        # only look up the keys just seen and append the new ones
+        new_log_entries = []
+        for log_entry in event_log_record:
+            key = "{}-{}".format(log_entry['Timestamp'],log_entry['Index'])
+            if key not in self.store:
+                new_log_entries.append((key, log_entry))
 
-        # merge entries
-        old_log_entries.update(log_entries)
-        
-        # save event log
+        no_entries_added = 0
         try:
-            with open(self.event_log_filename,'w') as out_file: 
-                json.dump(old_log_entries, out_file, indent=1, sort_keys=True)
+            no_entries_added = self.store.append(new_log_entries)
         except IOError as e:
             self.logger.error("Cannot write new event_log :" + str(e))
-        no_entries_added = len(old_log_entries) - no_old_entries
-          
-
-        # Report number of entries added to the local file
-        yield GaugeMetricFamily(
-            'tg3442de_event_log_local_added',
-            'Number of entries added to local Event Log storage',
-            value = no_entries_added
+
+        # entries dropped by retention before are not stored and not counted again
+        counted = False
+        for key, log_entry in new_log_entries:
+            if key in self.store:
+                self.count_event(log_entry)
+                counted = True
+        if counted:
+            self._write_event_counts()
+        return no_entries_added
+
+    def extract(self, raw_htmls: Dict[str, bytes]) -> Iterable[Metric]:
+        self.logger.debug("EventLogLocal")
+        yield from self.store.metrics('tg3442de_event_log_local', 'Event Log')
+
+        # parse Event Log
+        raw_html = raw_htmls[GET_EVENT_LOG_LOCAL]
+        if len(raw_html) >= 10:
+            # parse json
+            json_event_log_dat = self.json_loads(raw_html)
+
+            event_log_record = json_event_log_dat['eventLog']
+            if len(event_log_record) > 0:
+                no_entries_added = self.store_new_entries(event_log_record)
+
+                # Report number of entries added to the local file
+                yield GaugeMetricFamily(
+                    'tg3442de_event_log_local_added',
+                    'Number of entries added to local Event Log storage',
+                    value = no_entries_added
+                )
+
+        events = CounterMetricFamily(
+            'tg3442de_events',
+            'Number of stored Event Log entries by event type and priority',
+            labels=['type', 'priority']
         )
+        for (event_type, priority), count in sorted(self.event_counts.items()):
+            events.add_metric([event_type, priority], count)
+        yield events
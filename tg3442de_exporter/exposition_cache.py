@@ -0,0 +1,130 @@
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, Tuple
+
+from prometheus_client import Metric
+from prometheus_client.exposition import generate_latest
+from prometheus_client.metrics_core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.openmetrics import exposition as openmetrics
+
+# OpenMetrics output ends with this line, cached bodies are stored without it and get it with the tail
+OPENMETRICS_EOF = b"# EOF\n"
+
+# window bits selecting the gzip container in zlib
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class _ListCollector(object):
+    """Minimal registry handing out already collected metric families to the encoders"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def collect(self):
+        return self.metrics
+
+
+class ExpositionCache:
+    """
+    Exposition of the metrics which only change with the collector's generation (the polled
+    snapshot), rendered once per generation and format (text or OpenMetrics) and kept as bytes and
+    gzip compressed bytes. Requests get these bytes plus a small tail rendered per request for the
+    metrics changing all the time. Both formats are a plain concatenation of families (OpenMetrics
+    terminated by '# EOF'), so both parts can be sent one after another. The compressor state after
+    the cached body is kept as well and a copy of it compresses the tail, so the response is a
+    single gzip stream, as some clients (e.g. curl) stop after the first of concatenated members.
+
+    Collectors without generation (no background polling) are rendered on every request.
+    """
+
+    def __init__(self, collector):
+        """
+        :param collector: TG3442DECollector or MultiTargetCollector
+        """
+        self.collector = collector
+        # held while rendering, so concurrent requests of a new generation render only once
+        self._lock = threading.Lock()
+        self._generation = None
+        # (body, gzip compressed body, compressor state after it) by format of the current generation
+        self._bodies = {}  # type: Dict[bool, Tuple[bytes, bytes, object]]
+        self._stats_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.render_duration = None
+
+    def render(self, gzipped: bool, open_metrics: bool = False) -> bytes:
+        """
+        :param gzipped: whether to return gzip compressed output
+        :param open_metrics: OpenMetrics instead of the text format
+        :return: exposition of all metrics
+        """
+        body, gzip_body, compressor = self._cached(gzipped, open_metrics)
+        live = _ListCollector(list(self.collector.collect_live()) + list(self.metrics()))
+        tail = openmetrics.generate_latest(live) if open_metrics else generate_latest(live)
+        if gzipped:
+            # continue the stream of the cached body, the compressor itself is shared by all requests
+            compressor = compressor.copy()
+            return gzip_body + compressor.compress(tail) + compressor.flush()
+        return body + tail
+
+    def _cached(self, gzipped: bool, open_metrics: bool) -> Tuple[bytes, bytes, object]:
+        generation = self.collector.generation
+        if generation is None:
+            # nothing to share, concurrent requests are coalesced by the collector
+            with self._stats_lock:
+                self.misses += 1
+            return self._render(gzipped, open_metrics)
+        with self._lock:
+            if generation != self._generation:
+                self._bodies = {}
+                self._generation = generation
+            bodies = self._bodies.get(open_metrics)
+            if bodies is not None:
+                with self._stats_lock:
+                    self.hits += 1
+                return bodies
+            with self._stats_lock:
+                self.misses += 1
+            # compressed once for all requests of this generation
+            bodies = self._bodies[open_metrics] = self._render(True, open_metrics)
+            return bodies
+
+    def _render(self, gzipped: bool, open_metrics: bool) -> Tuple[bytes, bytes, object]:
+        pre_render_time = time.time()
+        cacheable = _ListCollector(list(self.collector.collect_cacheable()))
+        if open_metrics:
+            body = openmetrics.generate_latest(cacheable)
+            # the tail carries the end marker
+            if body.endswith(OPENMETRICS_EOF):
+                body = body[:-len(OPENMETRICS_EOF)]
+        else:
+            body = generate_latest(cacheable)
+        gzip_body = b""
+        compressor = None
+        if gzipped:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, GZIP_WBITS)
+            # flushed to a byte boundary, so the tail can follow in the same stream
+            gzip_body = compressor.compress(body) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.render_duration = time.time() - pre_render_time
+        return body, gzip_body, compressor
+
+    def metrics(self) -> Iterable[Metric]:
+        yield CounterMetricFamily(
+            "tg3442de_exposition_cache_hits",
+            "Number of /metrics requests served from the rendered snapshot",
+            value=self.hits,
+        )
+        yield CounterMetricFamily(
+            "tg3442de_exposition_cache_misses",
+            "Number of /metrics requests rendering the metrics",
+            value=self.misses,
+        )
+        if self.render_duration is not None:
+            yield GaugeMetricFamily(
+                "tg3442de_exposition_render_duration",
+                "Duration of the last rendering of the metrics",
+                unit="seconds",
+                value=self.render_duration,
+            )
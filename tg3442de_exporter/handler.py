@@ -0,0 +1,209 @@
+import json
+from datetime import datetime
+from urllib.parse import parse_qs, urlparse
+
+from prometheus_client import MetricsHandler
+from prometheus_client.exposition import choose_encoder
+from prometheus_client.openmetrics import exposition as openmetrics
+
+from tg3442de_exporter.exposition_cache import _ListCollector
+from tg3442de_exporter.profiler import ProfilerBusyError
+
+LOG_PAGE_SIZE = 1000
+LOG_MAX_PAGE_SIZE = 10000
+PROFILE_SECONDS = 10
+PROFILE_MAX_SECONDS = 300
+
+
+def parse_time(value: str) -> float:
+    """
+    Unix timestamp given either as number or as ISO 8601 date/time
+    :raises: ValueError
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+class TG3442DEMetricsHandler(MetricsHandler):
+    """
+    MetricsHandler serving /metrics plus the multi-target endpoint /probe?target=<name> and optionally
+    the local log history at /logs/calls and /logs/events, /openmetrics, /debug/profile and /debug/scrapes
+    """
+    multi_target = None
+    # log stores by kind ('calls', 'events') by target name, target None in single-target mode,
+    # None unless log endpoints are enabled
+    log_stores = None
+    exposition_cache = None
+    openmetrics = False
+    # ScrapeProfiler and ScrapeInstrumentation by target name, None unless debug endpoints are enabled
+    profiler = None
+    instrumentations = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/probe":
+            self.do_probe(parse_qs(url.query))
+        elif url.path.startswith("/logs/") and self.log_stores is not None:
+            self.do_logs(url.path[len("/logs/"):], parse_qs(url.query))
+        elif url.path == "/openmetrics" and self.openmetrics:
+            self.do_openmetrics()
+        elif url.path == "/debug/profile" and self.profiler is not None:
+            self.do_profile(parse_qs(url.query))
+        elif url.path == "/debug/scrapes" and self.instrumentations is not None:
+            self.do_scrapes(parse_qs(url.query))
+        else:
+            self.do_metrics(parse_qs(url.query))
+
+    def do_metrics(self, params):
+        """
+        Serves the text or OpenMetrics exposition, as chosen by the Accept header, from the exposition cache.
+        name[] filters are rendered by MetricsHandler
+        """
+        encoder, content_type = choose_encoder(self.headers.get("Accept"))
+        if self.exposition_cache is None or "name[]" in params:
+            super(TG3442DEMetricsHandler, self).do_GET()
+            return
+
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        open_metrics = content_type == openmetrics.CONTENT_TYPE_LATEST
+        output = self._profiled(lambda: self.exposition_cache.render(gzipped, open_metrics))
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(output)
+
+    def do_openmetrics(self):
+        """
+        Serves all metrics in the OpenMetrics format, regardless of the Accept header, from the exposition cache
+        """
+        gzipped = False
+        if self.exposition_cache is None:
+            output = self._profiled(lambda: openmetrics.generate_latest(self.registry))
+        else:
+            gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+            output = self._profiled(lambda: self.exposition_cache.render(gzipped, True))
+        self.send_response(200)
+        self.send_header("Content-Type", openmetrics.CONTENT_TYPE_LATEST)
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.end_headers()
+        self.wfile.write(output)
+
+    def do_probe(self, params):
+        if self.multi_target is None:
+            self.send_error(404, "Multi-target mode is not configured")
+            return
+        target = params.get("target", [None])[0]
+        if target not in self.multi_target.collectors:
+            self.send_error(400, f"Unknown target '{target}'")
+            return
+
+        encoder, content_type = choose_encoder(self.headers.get("Accept"))
+        output = self._profiled(lambda: encoder(_ListCollector(self.multi_target.collect_target(target))))
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.end_headers()
+        self.wfile.write(output)
+
+    def do_logs(self, kind, params):
+        """
+        Streams stored log entries as NDJSON, oldest first. Parameters: since, until (unix timestamp or
+        ISO 8601), limit, cursor (from the X-Next-Cursor header of the previous page), target (multi-target mode).
+        """
+        target = params.get("target", [None])[0]
+        store = self.log_stores.get(target, {}).get(kind)
+        if store is None:
+            self.send_error(404, f"No local '{kind}' log for target '{target}'")
+            return
+        try:
+            since = parse_time(params["since"][0]) if "since" in params else None
+            until = parse_time(params["until"][0]) if "until" in params else None
+            limit = min(int(params.get("limit", [LOG_PAGE_SIZE])[0]), LOG_MAX_PAGE_SIZE)
+            after = None
+            if "cursor" in params:
+                timestamp, key = params["cursor"][0].split(",", 1)
+                after = (float(timestamp), key)
+        except ValueError as e:
+            self.send_error(400, f"Invalid parameter: {e}")
+            return
+        if limit < 1:
+            self.send_error(400, "Invalid parameter: limit must be positive")
+            return
+
+        entries, more = store.query(since=since, until=until, after=after, limit=limit)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        if more:
+            timestamp, key = entries[-1][:2]
+            self.send_header("X-Next-Cursor", f"{timestamp!r},{key}")
+        self.end_headers()
+        for line in store.read(entries):
+            self.wfile.write(line)
+
+    def do_profile(self, params):
+        """
+        Profiles scrapes and renderings of the metrics for the next `seconds` (default 10). With mode=cprofile
+        (default) pstats output is returned, with mode=sample collapsed stacks of the sampled threads.
+        """
+        mode = params.get("mode", ["cprofile"])[0]
+        try:
+            seconds = float(params.get("seconds", [PROFILE_SECONDS])[0])
+        except ValueError as e:
+            self.send_error(400, f"Invalid parameter: {e}")
+            return
+        if not 0 < seconds <= PROFILE_MAX_SECONDS:
+            self.send_error(400, f"Invalid parameter: seconds must be within (0, {PROFILE_MAX_SECONDS}]")
+            return
+        if mode not in ("cprofile", "sample"):
+            self.send_error(400, f"Invalid parameter: unknown mode '{mode}'")
+            return
+
+        try:
+            if mode == "cprofile":
+                output = self.profiler.profile(seconds)
+            else:
+                output = self.profiler.sample(seconds)
+        except ProfilerBusyError as e:
+            self.send_error(409, str(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.end_headers()
+        self.wfile.write(output.encode("utf-8"))
+
+    def do_scrapes(self, params):
+        """
+        Lists the phase timings of the last scrapes as JSON, oldest first. Parameter: target (multi-target mode).
+        """
+        target = params.get("target", [None])[0]
+        instrumentation = self.instrumentations.get(target)
+        if instrumentation is None:
+            self.send_error(404, f"No scrapes of target '{target}'")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(instrumentation.scrapes()).encode("utf-8"))
+
+    def _profiled(self, function):
+        return self.profiler.run(function) if self.profiler is not None else function()
+
+    @classmethod
+    def factory(cls, registry, multi_target=None, log_stores=None, exposition_cache=None, openmetrics=False,
+                profiler=None, instrumentations=None):
+        """
+        Returns a handler class tied to the passed registry and, in multi-target mode, the MultiTargetCollector
+        """
+        return type(str(cls.__name__), (cls, object), {
+            "registry": registry,
+            "multi_target": multi_target,
+            "log_stores": log_stores,
+            "exposition_cache": exposition_cache,
+            "openmetrics": openmetrics,
+            "profiler": profiler,
+            "instrumentations": instrumentations,
+        })
@@ -1,11 +1,19 @@
 
+import json
 import re
+import time
 from logging import Logger
 from typing import Iterable, Set, Dict
 
 from prometheus_client import Metric
 
+from tg3442de_exporter.js_scanner import scan_js_vars
+
 class HtmlMetricsExtractor:
+    # metrics depend on the page content only, so they can be reused while the content does not change
+    cacheable = True
+    # seconds spent parsing pages (javascript variables, JSON, regular expressions) since last reset
+    parse_duration = 0.0
 
     def __init__(self, name: str, pages: Set, logger: Logger):
         self._name = name
@@ -47,8 +55,32 @@ class HtmlMetricsExtractor:
         self._logger.debug("HtmlMetricsExtractor")
         raise NotImplementedError
 
+    def js_vars(self, raw_html: str) -> Dict[str, str]:
+        """
+        Returns all js_X and json_X variables of a page, scanned in a single pass
+        :param raw_html: page content
+        :return: values by variable name
+        """
+        start = time.time()
+        try:
+            return scan_js_vars(raw_html)
+        finally:
+            self.parse_duration += time.time() - start
+
+    def json_loads(self, text: str):
+        """
+        json.loads, counted as parsing time
+        """
+        start = time.time()
+        try:
+            return json.loads(text)
+        finally:
+            self.parse_duration += time.time() - start
+
     def re_search(self,pattern,text,no,default='Unknown'):
+        start = time.time()
         result = re.search(pattern,text)
+        self.parse_duration += time.time() - start
         if result != None:
             if len(result.groups()) != no:
                 return [default]*(no)
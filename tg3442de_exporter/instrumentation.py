@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Sequence
+
+from prometheus_client import Metric
+from prometheus_client.metrics_core import CounterMetricFamily, HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
+
+# buckets of the prometheus_client Histogram, up to the default Prometheus scrape timeout of 10s
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, float("inf"))
+
+
+class Histograms:
+    """
+    Cumulative histograms of one metric family, one per combination of label values
+    """
+
+    def __init__(self, name: str, documentation: str, labels: List[str], buckets: Sequence[float], unit: str = ""):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.unit = unit
+        self._lock = threading.Lock()
+        # (bucket counts, sum) by label values
+        self._histograms = {}  # type: Dict[tuple, list]
+
+    def observe(self, labels: tuple, value: float):
+        with self._lock:
+            histogram = self._histograms.get(labels)
+            if histogram is None:
+                histogram = self._histograms[labels] = [[0] * len(self.buckets), 0.0]
+            counts = histogram[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            histogram[1] += value
+
+    def metric(self) -> Metric:
+        metric = HistogramMetricFamily(self.name, self.documentation, labels=self.labels, unit=self.unit)
+        with self._lock:
+            for labels, (counts, sum_value) in self._histograms.items():
+                buckets = []
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    buckets.append((floatToGoString(bound), cumulative))
+                metric.add_metric(list(labels), buckets, sum_value)
+        return metric
+
+
+class ScrapeInstrumentation:
+    """
+    Timing of the phases of all scrapes of one TG3442DE: login, page fetches by page, extraction
+    split into parsing and building the metrics, and logout. Failures are counted by phase and
+    exception class. The timings of the last scrapes are kept as they are for /debug/scrapes.
+    """
+
+    def __init__(self, history_size: int):
+        """
+        :param history_size: number of scrapes kept in the history
+        """
+        self.phases = Histograms(
+            "tg3442de_scrape_phase",
+            "Duration of the phases of scrapes",
+            ["phase"], DURATION_BUCKETS, unit="seconds",
+        )
+        self.page_fetches = Histograms(
+            "tg3442de_page_fetch_latency",
+            "Duration of TG3442DE page fetches",
+            ["page"], DURATION_BUCKETS, unit="seconds",
+        )
+        self.response_sizes = Histograms(
+            "tg3442de_page_response",
+            "Size of TG3442DE page responses",
+            ["page"], SIZE_BUCKETS, unit="bytes",
+        )
+        self.extract_steps = Histograms(
+            "tg3442de_extract",
+            "Duration of parsing pages and building metrics by extractor",
+            ["extractor", "step"], DURATION_BUCKETS, unit="seconds",
+        )
+        self._lock = threading.Lock()
+        self.failures = Counter()  # type: Counter
+        self.history = deque(maxlen=history_size)
+
+    @contextmanager
+    def phase(self, phase: str, timings: Dict[str, float]):
+        """
+        Times the block as one phase of a scrape, also when it raises
+        :param phase: phase name
+        :param timings: durations of the phases of the current scrape
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            timings[phase] = time.time() - start
+
+    def record(self, timestamp: float, phases: Dict[str, float], fetch_duration: Dict[str, float],
+               response_sizes: Dict[str, int], extract_steps: Dict[str, Dict[str, float]], failed: bool):
+        """
+        Adds the timings of a finished scrape to the histograms and the history
+        :param timestamp: start of the scrape
+        :param phases: duration by phase
+        :param fetch_duration: duration by page
+        :param response_sizes: response size by page
+        :param extract_steps: duration by step ('parse', 'build') by extractor
+        :param failed: whether the scrape failed
+        """
+        for phase, duration in phases.items():
+            self.phases.observe((phase,), duration)
+        for page, duration in fetch_duration.items():
+            self.page_fetches.observe((page,), duration)
+        for page, size in response_sizes.items():
+            self.response_sizes.observe((page,), size)
+        for extractor, steps in extract_steps.items():
+            for step, duration in steps.items():
+                self.extract_steps.observe((extractor, step), duration)
+        self.history.append({
+            "timestamp": timestamp,
+            "failed": failed,
+            "phases": phases,
+            "pages": {
+                page: {"seconds": duration, "bytes": response_sizes.get(page)}
+                for page, duration in fetch_duration.items()
+            },
+            "extractors": extract_steps,
+        })
+
+    def scrapes(self) -> List[Dict]:
+        """
+        :return: timings of the last scrapes, oldest first
+        """
+        return list(self.history)
+
+    def failure(self, phase: str, exception: BaseException):
+        with self._lock:
+            self.failures[(phase, type(exception).__name__)] += 1
+
+    def metrics(self) -> Iterable[Metric]:
+        yield self.phases.metric()
+        yield self.page_fetches.metric()
+        yield self.response_sizes.metric()
+        yield self.extract_steps.metric()
+        failures = CounterMetricFamily(
+            "tg3442de_scrape_failures",
+            "Number of failed scrape phases by exception class",
+            labels=["phase", "exception"],
+        )
+        with self._lock:
+            for labels, count in self.failures.items():
+                failures.add_metric(list(labels), count)
+        yield failures
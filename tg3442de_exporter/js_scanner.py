@@ -0,0 +1,29 @@
+import re
+from typing import Dict
+
+# js_X and json_X assignments of the PHP generated javascript, e.g.
+#   var js_FWVersion = 'AR01.04.046.17_060822_7244.SIP.10.X1';
+#   var json_dsData = [{"ChannelID":"1", ...}];
+# the value is a quoted string or extends to the next ';', so several assignments on one line are
+# found each
+_JS_VAR_ASSIGNMENT = re.compile(
+    r"""\b((?:js|json)_\w+)[ \t]*=(?!=)[ \t]*('(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"|[^;\n]*)[ \t]*;"""
+)
+
+
+def scan_js_vars(text: str) -> Dict[str, str]:
+    """
+    Collects all js_X and json_X assignments of a page in one pass. Quoted values are returned
+    without quotes, for variables assigned more than once the first assignment wins.
+    :param text: page content
+    :return: values by variable name
+    """
+    js_vars = {}
+    for match in _JS_VAR_ASSIGNMENT.finditer(text):
+        name, value = match.group(1, 2)
+        if name in js_vars:
+            continue
+        if len(value) >= 2 and value[0] == "'" and value[-1] == "'":
+            value = value[1:-1]
+        js_vars[name] = value
+    return js_vars
@@ -0,0 +1,82 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from requests import Timeout
+
+# lower bound of adaptive timeouts, the TG3442DE occasionally needs a second even when healthy
+MIN_TIMEOUT_SECONDS = 2.0
+
+
+class LatencyTracker:
+    """
+    Tracks the latency of requests to one TG3442DE as exponentially weighted moving average and
+    deviation (like the retransmission timeout of TCP, RFC 6298). With adaptive timeouts, each request
+    gets the average plus four deviations as timeout, between MIN_TIMEOUT_SECONDS and max_timeout.
+
+    A scrape sets a deadline for its thread, requests never wait beyond it.
+    """
+
+    def __init__(self, max_timeout: float, adaptive: bool):
+        """
+        :param max_timeout: timeout without latency data and upper bound of adaptive timeouts
+        :param adaptive: whether timeouts adapt to the latency, otherwise max_timeout is used
+        """
+        self.max_timeout = max_timeout
+        self.adaptive = adaptive
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.average = None  # type: Optional[float]
+        self.deviation = 0.0
+
+    def observe(self, seconds: float):
+        with self._lock:
+            if self.average is None:
+                self.average = seconds
+                self.deviation = seconds / 2
+            else:
+                self.deviation = 0.75 * self.deviation + 0.25 * abs(self.average - seconds)
+                self.average = 0.875 * self.average + 0.125 * seconds
+
+    def adaptive_timeout(self) -> float:
+        """
+        :return: timeout for the next request, ignoring the deadline
+        """
+        with self._lock:
+            if not self.adaptive or self.average is None:
+                return self.max_timeout
+            return min(max(self.average + 4 * self.deviation, MIN_TIMEOUT_SECONDS), self.max_timeout)
+
+    def remaining(self) -> Optional[float]:
+        """
+        :return: seconds left until the deadline of the current thread, None without deadline
+        """
+        deadline = getattr(self._local, "deadline", None)
+        return deadline - time.time() if deadline is not None else None
+
+    def timeout(self) -> float:
+        """
+        :return: timeout for the next request of the current thread
+        :raises: requests.Timeout if the deadline passed
+        """
+        timeout = self.adaptive_timeout()
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise Timeout("Scrape deadline exceeded")
+        return min(timeout, remaining)
+
+    @contextmanager
+    def deadline(self, deadline: Optional[float]):
+        """
+        Bounds all requests of the current thread within the block
+        :param deadline: unix time, None for no deadline
+        """
+        previous = getattr(self._local, "deadline", None)
+        self._local.deadline = deadline
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
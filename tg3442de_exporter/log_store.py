@@ -0,0 +1,581 @@
+import bisect
+import gzip
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import traceback
+from logging import Logger
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from prometheus_client import Metric
+from prometheus_client.metrics_core import GaugeMetricFamily
+
+# segment number of the active, uncompressed data file; rotated segments are numbered from 1
+ACTIVE_SEGMENT = 0
+
+# (timestamp, segment, byte offset in the uncompressed segment) by key
+IndexEntry = Tuple[float, int, int]
+# (timestamp, key, segment, offset) as returned by LogStore.query
+QueryEntry = Tuple[float, str, int, int]
+
+
+class LogRetention(NamedTuple):
+    """
+    Limits of a LogStore, 0 disables a limit
+    """
+    max_age_seconds: float = 0
+    max_entries: int = 0
+    max_bytes: int = 0
+    # the active data file is compressed into a segment once it reaches this size
+    segment_bytes: int = 1024 * 1024
+
+
+def log_retention(exporter_config: Dict) -> LogRetention:
+    """
+    Retention settings of the local log stores from the exporter config
+    """
+    return LogRetention(
+        max_age_seconds=exporter_config['log_max_age_days'] * 86400,
+        max_entries=exporter_config['log_max_entries'],
+        max_bytes=exporter_config['log_max_bytes'],
+        segment_bytes=exporter_config['log_segment_bytes'],
+    )
+
+
+class Segment:
+    """
+    Rotated part of a LogStore: <filename>.<number>.gz plus its index <filename>.<number>.idx.
+    Right after rotation the segment is still uncompressed (<filename>.<number>) until compaction compresses it.
+    """
+
+    def __init__(self, path: str, compressed: bool):
+        self.path = path
+        self.compressed = compressed
+        self.disk_bytes = os.path.getsize(path)
+
+    def open(self):
+        return gzip.open(self.path, "rb") if self.compressed else open(self.path, "rb")
+
+
+class LogStore:
+    """
+    Append-only local store for log entries of the TG3442DE.
+
+    Entries are appended as JSON lines {"key": ..., "timestamp": ..., "entry": {...}} to the data file.
+    A compact index file next to it (<filename>.idx, one 'key<TAB>timestamp<TAB>offset' line per entry)
+    keeps the keys in memory, so a scrape only looks up the keys it just saw and appends new entries,
+    instead of reading and rewriting the whole history.
+
+    compact() rotates a full data file into a gzip compressed segment and drops the oldest entries
+    beyond the LogRetention limits. It is meant to run in the background thread started by start().
+
+    The timestamp up to which entries have been dropped is kept in <filename>.retained, so entries
+    still listed by the TG3442DE are not stored again after a restart.
+
+    Files written by former versions as one JSON object {key: entry} are converted on first use,
+    the original file is kept as <filename>.bak.
+    """
+
+    def __init__(self, filename: str, logger: Logger, timestamp_of: Callable[[str, Dict], Optional[float]],
+                 retention: LogRetention = LogRetention()):
+        """
+        :param filename: data file
+        :param logger: logging logger
+        :param timestamp_of: returns the unix timestamp of an entry given key and entry, None if unknown,
+            in which case the time the entry is stored is used
+        :param retention: limits applied by compact()
+        """
+        self.filename = filename
+        self.index_filename = filename + ".idx"
+        self.retained_filename = filename + ".retained"
+        self.logger = logger
+        self.timestamp_of = timestamp_of
+        self.retention = retention
+        self._lock = threading.RLock()
+        self._index = {}  # type: Dict[str, IndexEntry]
+        # (timestamp, key, segment, offset) sorted by timestamp for range queries and retention
+        self._by_timestamp = []  # type: List[QueryEntry]
+        self._high_water_mark = None  # type: Optional[float]
+        self._segments = {}  # type: Dict[int, Segment]
+        self._active_bytes = 0
+        # entries up to this timestamp have been dropped by retention and are not stored again
+        self._retained_after = self._read_retained_after()
+
+        self._compaction_lock = threading.Lock()
+        self.last_compaction_duration = None  # type: Optional[float]
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._convert_legacy_file()
+        self._load_segments()
+        self._load_index()
+        self._by_timestamp = sorted(
+            (timestamp, key, segment, offset) for key, (timestamp, segment, offset) in self._index.items()
+        )
+        if self._by_timestamp:
+            self._high_water_mark = self._by_timestamp[-1][0]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def high_water_mark(self) -> Optional[float]:
+        """
+        Timestamp of the newest stored entry, None if the store is empty
+        """
+        return self._high_water_mark
+
+    @property
+    def disk_bytes(self) -> int:
+        """
+        Size of the data file and all segments on disk
+        """
+        with self._lock:
+            return self._active_bytes + sum(segment.disk_bytes for segment in self._segments.values())
+
+    def _timestamp(self, key: str, entry: Dict) -> float:
+        timestamp = self.timestamp_of(key, entry)
+        if timestamp is None:
+            # the arrival time keeps the entry in order and subject to the age limit like the others
+            self.logger.warning(f"Unknown timestamp of entry '{key}' in {self.filename}, using its arrival time")
+            return time.time()
+        return float(timestamp)
+
+    def _read_retained_after(self) -> Optional[float]:
+        try:
+            with open(self.retained_filename) as f:
+                return float(f.read())
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            self.logger.warning(f"Ignoring invalid retention cutoff in {self.retained_filename}")
+            return None
+
+    def _write_retained_after(self, retained_after: float):
+        with open(self.retained_filename + ".tmp", "w") as f:
+            f.write(repr(retained_after))
+        os.replace(self.retained_filename + ".tmp", self.retained_filename)
+
+    def _segment_filename(self, number: int) -> str:
+        return f"{self.filename}.{number}"
+
+    def _convert_legacy_file(self):
+        try:
+            with open(self.filename) as in_file:
+                first_line = in_file.readline().strip()
+                if first_line not in ("{", "{}"):
+                    return
+                in_file.seek(0)
+                old_log_entries = json.load(in_file)
+        except FileNotFoundError:
+            return
+
+        self.logger.info(f"Converting {self.filename} to append-only log")
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w") as out_file:
+            for key in sorted(old_log_entries.keys()):
+                entry = old_log_entries[key]
+                out_file.write(self._encode(key, self._timestamp(key, entry), entry))
+        os.replace(self.filename, self.filename + ".bak")
+        os.replace(temp_filename, self.filename)
+        if os.path.exists(self.index_filename):
+            os.remove(self.index_filename)
+
+    @staticmethod
+    def _encode(key: str, timestamp: float, entry: Dict) -> str:
+        return json.dumps({"key": key, "timestamp": timestamp, "entry": entry}, separators=(",", ":")) + "\n"
+
+    @staticmethod
+    def _read_index(index_filename: str) -> List[Tuple[str, float, int]]:
+        """
+        :return: (key, timestamp, offset) of all lines of an index file
+        :raises: FileNotFoundError, ValueError if the file is damaged
+        """
+        entries = []
+        with open(index_filename) as index_file:
+            for line in index_file:
+                key, timestamp, offset = line.rstrip("\n").split("\t")
+                entries.append((key, float(timestamp), int(offset)))
+        return entries
+
+    @staticmethod
+    def _scan(data_file) -> Iterator[Tuple[str, float, int, bytes]]:
+        """
+        :return: (key, timestamp, offset, line) of all complete lines from the current position
+        """
+        while True:
+            offset = data_file.tell()
+            line = data_file.readline()
+            if not line.endswith(b"\n"):
+                data_file.seek(offset)
+                return
+            record = json.loads(line)
+            yield record["key"], record["timestamp"], offset, line
+
+    @staticmethod
+    def _write_index(index_filename: str, entries: Iterable[Tuple[str, float, int]], mode: str = "w"):
+        with open(index_filename, mode) as index_file:
+            index_file.write("".join(f"{key}\t{timestamp!r}\t{offset}\n" for key, timestamp, offset in entries))
+
+    def _load_segments(self):
+        directory = os.path.dirname(self.filename) or "."
+        pattern = re.compile(re.escape(os.path.basename(self.filename)) + r"\.(\d+)(\.gz)?$")
+        found = {}  # type: Dict[int, bool]
+        for name in os.listdir(directory):
+            match = pattern.match(name)
+            if match:
+                number = int(match[1])
+                found[number] = found.get(number, False) or bool(match[2])
+
+        for number in sorted(found):
+            filename = self._segment_filename(number)
+            if found[number]:
+                # compression finished, the uncompressed file was left behind by an interruption
+                if os.path.exists(filename):
+                    os.remove(filename)
+                segment = Segment(filename + ".gz", compressed=True)
+            else:
+                segment = Segment(filename, compressed=False)
+
+            index_filename = filename + ".idx"
+            try:
+                entries = self._read_index(index_filename)
+            except (FileNotFoundError, ValueError):
+                self.logger.warning(f"Rebuilding index {index_filename}")
+                with segment.open() as data_file:
+                    entries = [(key, timestamp, offset) for key, timestamp, offset, _ in self._scan(data_file)]
+                self._write_index(index_filename, entries)
+            for key, timestamp, offset in entries:
+                self._index.setdefault(key, (timestamp, number, offset))
+            self._segments[number] = segment
+
+    def _load_index(self):
+        if not os.path.exists(self.filename):
+            # the data file was rotated, but its index was not
+            if os.path.exists(self.index_filename):
+                os.remove(self.index_filename)
+            return
+
+        indexed_offset = -1
+        try:
+            for key, timestamp, offset in self._read_index(self.index_filename):
+                self._index.setdefault(key, (timestamp, ACTIVE_SEGMENT, offset))
+                indexed_offset = max(indexed_offset, offset)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            self.logger.warning(f"Index {self.index_filename} is damaged, rebuilding it")
+            self._index = {key: value for key, value in self._index.items() if value[1] != ACTIVE_SEGMENT}
+            indexed_offset = -1
+            os.remove(self.index_filename)
+
+        # index entries appended to the data file but not to the index, e.g. after a crash
+        with open(self.filename, "r+b") as data_file:
+            if indexed_offset >= 0:
+                data_file.seek(indexed_offset)
+                data_file.readline()
+            missing = []
+            for key, timestamp, offset, _ in self._scan(data_file):
+                missing.append((key, timestamp, offset))
+            end = data_file.tell()
+            if data_file.readline():
+                # drop the incomplete last line of an interrupted write
+                self.logger.warning(f"Dropping incomplete entry at the end of {self.filename}")
+                data_file.truncate(end)
+            self._active_bytes = end
+        if missing:
+            for key, timestamp, offset in missing:
+                self._index.setdefault(key, (timestamp, ACTIVE_SEGMENT, offset))
+            self._write_index(self.index_filename, missing, "a")
+
+    def append(self, entries: Iterable[Tuple[str, Dict]]) -> int:
+        """
+        Appends all entries whose key is not stored yet and that have not been dropped by retention before
+        :param entries: (key, entry) tuples
+        :return: number of entries added
+        :raises: IOError if the store cannot be written
+        """
+        with self._lock:
+            new_entries = {}
+            for key, entry in entries:
+                if key not in self._index and key not in new_entries:
+                    new_entries[key] = entry
+            if not new_entries:
+                return 0
+
+            cutoff = self._retained_after
+            if self.retention.max_age_seconds:
+                max_age_cutoff = time.time() - self.retention.max_age_seconds
+                cutoff = max_age_cutoff if cutoff is None else max(cutoff, max_age_cutoff)
+
+            indexed = []
+            with open(self.filename, "ab") as data_file:
+                offset = data_file.tell()
+                for key, entry in new_entries.items():
+                    timestamp = self._timestamp(key, entry)
+                    if cutoff is not None and timestamp <= cutoff:
+                        continue
+                    line = self._encode(key, timestamp, entry).encode("utf-8")
+                    data_file.write(line)
+                    indexed.append((key, timestamp, offset))
+                    offset += len(line)
+                self._active_bytes = offset
+            for key, timestamp, offset in indexed:
+                self._index[key] = (timestamp, ACTIVE_SEGMENT, offset)
+                # entries usually arrive in order, so this inserts at the end
+                bisect.insort(self._by_timestamp, (timestamp, key, ACTIVE_SEGMENT, offset))
+                if self._high_water_mark is None or timestamp > self._high_water_mark:
+                    self._high_water_mark = timestamp
+            self._write_index(self.index_filename, indexed, "a")
+            return len(indexed)
+
+    def query(self, since: Optional[float] = None, until: Optional[float] = None, after: Optional[Tuple[float, str]] = None,
+              limit: int = 1000) -> Tuple[List[QueryEntry], bool]:
+        """
+        Looks up entries by timestamp using the in-memory index, without reading the data file
+        :param since: first timestamp to include
+        :param until: first timestamp to exclude
+        :param after: (timestamp, key) of the last entry of the previous page
+        :param limit: maximum number of entries
+        :return: (timestamp, key, segment, offset) of the matching entries and whether more entries follow
+        """
+        with self._lock:
+            start = 0
+            if since is not None:
+                start = bisect.bisect_left(self._by_timestamp, (since,))
+            if after is not None:
+                start = max(start, bisect.bisect_right(self._by_timestamp, (after[0], after[1], math.inf)))
+            end = len(self._by_timestamp)
+            if until is not None:
+                end = bisect.bisect_left(self._by_timestamp, (until,))
+            more = end - start > limit
+            return self._by_timestamp[start:min(end, start + limit)], more
+
+    def read(self, entries: Iterable[QueryEntry]) -> Iterator[bytes]:
+        """
+        Reads the stored JSON lines of entries returned by query(). Entries moved by a compaction
+        in the meantime are skipped.
+        :return: JSON lines including the trailing newline
+        """
+        data_files = {}
+        try:
+            for _, key, segment, offset in entries:
+                data_file = data_files.get(segment)
+                if data_file is None:
+                    with self._lock:
+                        if segment == ACTIVE_SEGMENT:
+                            data_file = open(self.filename, "rb")
+                        elif segment in self._segments:
+                            data_file = self._segments[segment].open()
+                        else:
+                            continue
+                    data_files[segment] = data_file
+                if data_file.tell() != offset:
+                    data_file.seek(offset)
+                line = data_file.readline()
+                if line.startswith(b'{"key":' + json.dumps(key).encode("utf-8") + b","):
+                    yield line
+        finally:
+            for data_file in data_files.values():
+                data_file.close()
+
+    def entries(self) -> Iterator[Tuple[str, Dict]]:
+        """
+        Reads all stored entries, oldest first
+        :return: (key, entry) tuples
+        """
+        entries, _ = self.query(limit=len(self))
+        for line in self.read(entries):
+            record = json.loads(line)
+            yield record["key"], record["entry"]
+
+    def start(self, interval: float):
+        """
+        Starts compacting in a background thread every interval seconds
+        """
+        if interval <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="tg3442de-log-compaction",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.compact()
+            except Exception:
+                self.logger.error(f"Compaction of {self.filename} failed.\n{traceback.format_exc()}")
+
+    def compact(self):
+        """
+        Rotates the data file into a compressed segment once it reached the segment size or holds
+        entries beyond the retention limits, then drops the oldest entries beyond the limits
+        """
+        with self._compaction_lock:
+            pre_compaction_time = time.time()
+            if self._active_bytes >= self.retention.segment_bytes or \
+                    any(segment == ACTIVE_SEGMENT for _, _, segment, _ in self._expired()):
+                self._rotate()
+            for number, segment in list(self._segments.items()):
+                if not segment.compressed:
+                    self._compress(number)
+            self._apply_retention()
+            self.last_compaction_duration = time.time() - pre_compaction_time
+
+    def _expired(self) -> List[QueryEntry]:
+        """
+        Oldest entries beyond the age and entry limits
+        """
+        with self._lock:
+            count = 0
+            if self.retention.max_age_seconds:
+                cutoff = time.time() - self.retention.max_age_seconds
+                count = bisect.bisect_left(self._by_timestamp, (cutoff,))
+            if self.retention.max_entries:
+                count = max(count, len(self._by_timestamp) - self.retention.max_entries)
+            return self._by_timestamp[:count]
+
+    def _rotate(self):
+        with self._lock:
+            if self._active_bytes == 0:
+                return
+            number = max(self._segments, default=ACTIVE_SEGMENT) + 1
+            filename = self._segment_filename(number)
+            self.logger.info(f"Rotating {self.filename} to {filename}")
+            os.replace(self.filename, filename)
+            if os.path.exists(self.index_filename):
+                os.replace(self.index_filename, filename + ".idx")
+            else:
+                self._write_index(filename + ".idx", [])
+            self._segments[number] = Segment(filename, compressed=False)
+            self._active_bytes = 0
+            self._relocate({
+                key: (timestamp, number, offset)
+                for key, (timestamp, segment, offset) in self._index.items() if segment == ACTIVE_SEGMENT
+            })
+
+    def _compress(self, number: int):
+        filename = self._segment_filename(number)
+        with open(filename, "rb") as in_file, gzip.open(filename + ".gz.tmp", "wb") as out_file:
+            shutil.copyfileobj(in_file, out_file)
+        with self._lock:
+            # readers still holding the uncompressed file keep reading it
+            os.replace(filename + ".gz.tmp", filename + ".gz")
+            os.remove(filename)
+            self._segments[number] = Segment(filename + ".gz", compressed=True)
+
+    def _apply_retention(self):
+        expired = self._expired()
+        if self.retention.max_bytes:
+            # whole segments, oldest first, while the store is too large
+            disk_bytes = self.disk_bytes
+            with self._lock:
+                segments = sorted(self._segments.items())
+                by_segment = {}
+                for timestamp, key, segment, offset in self._by_timestamp:
+                    by_segment.setdefault(segment, []).append((timestamp, key, segment, offset))
+            for number, segment in segments:
+                if disk_bytes <= self.retention.max_bytes:
+                    break
+                disk_bytes -= segment.disk_bytes
+                expired.extend(by_segment.get(number, []))
+        # entries appended since the rotation are left to the next compaction
+        expired = [entry for entry in expired if entry[2] != ACTIVE_SEGMENT]
+        if not expired:
+            return
+
+        dropped_by_segment = {}
+        for timestamp, key, segment, offset in expired:
+            dropped_by_segment.setdefault(segment, set()).add(key)
+        for number, dropped in dropped_by_segment.items():
+            self._drop(number, dropped)
+        self.logger.info(f"Dropped {sum(len(keys) for keys in dropped_by_segment.values())} entries "
+                         f"from {self.filename}")
+        with self._lock:
+            retained_after = max(timestamp for timestamp, _, _, _ in expired)
+            if self._retained_after is None or retained_after > self._retained_after:
+                # written before the next append, which would otherwise store the dropped entries again after a restart
+                self._write_retained_after(retained_after)
+                self._retained_after = retained_after
+
+    def _drop(self, number: int, dropped: set):
+        """
+        Rewrites a compressed segment without the dropped keys, removes it if nothing is left
+        """
+        filename = self._segment_filename(number)
+        kept = []
+        with self._segments[number].open() as in_file, gzip.open(filename + ".gz.tmp", "wb") as out_file:
+            offset = 0
+            for key, timestamp, _, line in self._scan(in_file):
+                if key in dropped:
+                    continue
+                out_file.write(line)
+                kept.append((key, timestamp, offset))
+                offset += len(line)
+        if kept:
+            self._write_index(filename + ".idx.tmp", kept)
+
+        with self._lock:
+            if kept:
+                os.replace(filename + ".gz.tmp", filename + ".gz")
+                os.replace(filename + ".idx.tmp", filename + ".idx")
+                self._segments[number] = Segment(filename + ".gz", compressed=True)
+            else:
+                os.remove(filename + ".gz.tmp")
+                os.remove(filename + ".gz")
+                os.remove(filename + ".idx")
+                del self._segments[number]
+            for key in dropped:
+                self._index.pop(key, None)
+            self._relocate({key: (timestamp, number, offset) for key, timestamp, offset in kept})
+
+    def _relocate(self, moved: Dict[str, IndexEntry]):
+        """
+        Updates the in-memory index after entries were moved or dropped
+        """
+        self._index.update(moved)
+        self._by_timestamp = sorted(
+            (timestamp, key, segment, offset) for key, (timestamp, segment, offset) in self._index.items()
+        )
+
+    def metrics(self, prefix: str, title: str) -> Iterable[Metric]:
+        """
+        Gauges on the size of the store and its last compaction
+        :param prefix: metric name prefix, e.g. tg3442de_event_log_local
+        :param title: name of the log in the help text, e.g. Event Log
+        """
+        with self._lock:
+            disk_bytes = self.disk_bytes
+            segments = len(self._segments)
+        yield GaugeMetricFamily(
+            f"{prefix}_store",
+            f"Size of the local {title} storage on disk",
+            unit="bytes",
+            value=disk_bytes,
+        )
+        yield GaugeMetricFamily(
+            f"{prefix}_store_segments",
+            f"Number of compressed segments of the local {title} storage",
+            value=segments,
+        )
+        if self.last_compaction_duration is not None:
+            yield GaugeMetricFamily(
+                f"{prefix}_last_compaction_duration",
+                f"Duration of the last compaction of the local {title} storage",
+                unit="seconds",
+                value=self.last_compaction_duration,
+            )
@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from logging import Logger
+from typing import Callable, Dict, Iterable, List, Optional
+
+from prometheus_client import Metric
+from prometheus_client.samples import Sample
+
+TARGET = "target"
+
+
+def with_label(metric: Metric, name: str, value: str) -> Metric:
+    """
+    Returns a copy of a metric family with an additional label on every sample
+    :param metric: metric family
+    :param name: label name
+    :param value: label value
+    :return: relabeled metric family
+    """
+    relabeled = Metric(metric.name, metric.documentation, metric.type, metric.unit)
+    relabeled.samples = [
+        Sample(s.name, dict(s.labels, **{name: value}), s.value, s.timestamp, s.exemplar)
+        for s in metric.samples
+    ]
+    return relabeled
+
+
+class MultiTargetCollector(object):
+    """
+    Scrapes a fleet of TG3442DE, one TG3442DECollector per target. Targets are scraped in parallel,
+    at most max_concurrent_targets at the same time, and every metric family is labeled with its target.
+    """
+
+    def __init__(self, logger: Logger, collectors: Dict, max_concurrent_targets: int):
+        self.logger = logger
+        self.collectors = collectors
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent_targets, thread_name_prefix="tg3442de-target")
+
+    def start(self):
+        for collector in self.collectors.values():
+            collector.start()
+
+    def collect_target(self, name: str) -> List[Metric]:
+        """
+        Scrapes a single target without target label, as used by /probe?target=
+        :param name: target name
+        :return: metric families
+        :raises: KeyError for unknown targets
+        """
+        collector = self.collectors[name]
+        return self.executor.submit(lambda: list(collector.collect())).result()
+
+    @property
+    def generation(self) -> Optional[tuple]:
+        """
+        Snapshot numbers of all targets, None unless all targets are polled
+        """
+        generations = tuple(collector.generation for collector in self.collectors.values())
+        return None if None in generations else generations
+
+    def _merged(self, collect: Callable) -> Iterable[Metric]:
+        futures = {
+            name: self.executor.submit(lambda collector=collector: list(collect(collector)))
+            for name, collector in self.collectors.items()
+        }
+
+        # merge families of all targets, the exposition format allows every family name only once
+        families = {}  # type: Dict[str, Metric]
+        for name, future in futures.items():
+            try:
+                metrics = future.result()
+            except Exception as e:
+                self.logger.error(f"Failed to collect target '{name}': {repr(e)}")
+                continue
+            for metric in metrics:
+                relabeled = with_label(metric, TARGET, name)
+                if metric.name in families:
+                    families[metric.name].samples.extend(relabeled.samples)
+                else:
+                    families[metric.name] = relabeled
+        yield from families.values()
+
+    def collect_cacheable(self) -> Iterable[Metric]:
+        yield from self._merged(lambda collector: collector.collect_cacheable())
+
+    def collect_live(self) -> Iterable[Metric]:
+        yield from self._merged(lambda collector: collector.collect_live())
+
+    def collect(self) -> Iterable[Metric]:
+        yield from self._merged(lambda collector: collector.collect())
+
+    def close(self):
+        for collector in self.collectors.values():
+            collector.close()
+        self.executor.shutdown()
@@ -1,5 +1,5 @@
-import re
-import json
+import time
+from collections import Counter, OrderedDict
 from logging import Logger
 from typing import Iterable, Set, Dict
 
@@ -14,31 +14,132 @@ OVERVIEW_STATUS = 'overview_status'
 
 GET_OVERVIEW      = '/php/overview_data.php'
 
+DEVICE_LABELS = ['index','hostname','MAC','IPv4','IPv6']
+# label value of the bucket summing up devices beyond the top N or the registry
+OTHER = 'other'
+
+
+class DeviceRegistry:
+    """
+    Devices by MAC in least recently seen order. Only registered devices get series of their own,
+    so the number of device series is bounded by max_devices.
+    """
+
+    def __init__(self, max_devices: int, expiry_seconds: float):
+        """
+        :param max_devices: maximum number of devices, 0 for no limit
+        :param expiry_seconds: devices not seen for this time are removed, 0 to keep them
+        """
+        self.max_devices = max_devices
+        self.expiry_seconds = expiry_seconds
+        self._last_seen = OrderedDict()  # type: OrderedDict
+
+    def __len__(self) -> int:
+        return len(self._last_seen)
+
+    def expire(self, now: float):
+        if not self.expiry_seconds:
+            return
+        while self._last_seen:
+            mac, last_seen = next(iter(self._last_seen.items()))
+            if now - last_seen <= self.expiry_seconds:
+                break
+            del self._last_seen[mac]
+
+    def seen(self, mac: str, now: float) -> bool:
+        """
+        Registers a device seen at now
+        :return: whether the device is registered, False if the registry is full of devices seen at now
+        """
+        if mac in self._last_seen:
+            self._last_seen[mac] = now
+            self._last_seen.move_to_end(mac)
+            return True
+        if self.max_devices and len(self._last_seen) >= self.max_devices:
+            least_recent_mac, last_seen = next(iter(self._last_seen.items()))
+            if last_seen >= now:
+                return False
+            del self._last_seen[least_recent_mac]
+        self._last_seen[mac] = now
+        return True
+
+
 class OverviewExtractor(HtmlMetricsExtractor):
     def __init__(self, logger: Logger, exporter_config: Dict):
         super(OverviewExtractor, self).__init__(
             OVERVIEW_STATUS, {GET_OVERVIEW}, logger
         )
         self.logger = logger
-
-    def add_devices(self,wlan_devices, metric : GaugeMetricFamily,link_speed):
+        # cardinality policy of the per-device series
+        device_config = exporter_config['overview_devices']
+        self.device_labels = [label for label in DEVICE_LABELS if label in device_config['labels']]
+        self.top_n = device_config['top_n']
+        self.registry = DeviceRegistry(device_config['max_devices'], device_config['expiry_seconds'])
+        # the registry has to see every extraction, cached families would skip registry.seen()
+        if device_config['max_devices'] or device_config['expiry_seconds']:
+            self.cacheable = False
+        # number of series dropped by the last extraction, by reason
+        self.dropped_series = Counter()  # type: Counter
+
+    @staticmethod
+    def link_rate_of(device: Dict, link_speed: str) -> float:
+        # handle speed and linkRate
+        values = str(device[link_speed]).split(' ')
+        link_rate = values[0]
+        if  link_rate == '-':
+            link_rate = 0.0
+        if len(values) == 2:
+            if values[1] == 'Gbps':
+                link_rate = float(link_rate) * 1000
+        return float(link_rate)
+
+    def add_devices(self,wlan_devices, metric : GaugeMetricFamily,link_speed, now: float):
+        devices = []
+        other_link_rate = None
         for device in wlan_devices:
-            index = device["Index"]
-            # handle speed and linkRate
-            values = str(device[link_speed]).split(' ')
-            link_rate = values[0]
-            if  link_rate == '-':
-                link_rate = 0.0
-            if len(values) == 2:
-                if values[1] == 'Gbps':
-                    link_rate = float(link_rate) * 1000
-            hostname = device['HostName']
-            mac = device['MAC']
-            ipV4 = device['IPv4']
-            ipV6 = device['IPv6']
-            labels = [str(index),hostname,mac,ipV4,ipV6]
-            metric.add_metric(labels,link_rate)
-
+            link_rate = self.link_rate_of(device, link_speed)
+            if not self.registry.seen(device['MAC'], now):
+                self.dropped_series['registry'] += 1
+                other_link_rate = (other_link_rate or 0.0) + link_rate
+                continue
+            devices.append((link_rate, device))
+
+        if self.top_n and len(devices) > self.top_n:
+            devices.sort(key=lambda rate_device: rate_device[0], reverse=True)
+            for link_rate, device in devices[self.top_n:]:
+                self.dropped_series['top_n'] += 1
+                other_link_rate = (other_link_rate or 0.0) + link_rate
+            devices = devices[:self.top_n]
+
+        # devices whose allowed labels are the same share one series with the highest link rate
+        series = {}
+        for link_rate, device in devices:
+            all_labels = {
+                'index': str(device["Index"]),
+                'hostname': device['HostName'],
+                'MAC': device['MAC'],
+                'IPv4': device['IPv4'],
+                'IPv6': device['IPv6'],
+            }
+            labels = tuple(all_labels[label] for label in self.device_labels)
+            if labels in series:
+                self.dropped_series['labels'] += 1
+                series[labels] = max(series[labels], link_rate)
+            else:
+                series[labels] = link_rate
+        if other_link_rate is not None:
+            other_labels = (OTHER,) * len(self.device_labels)
+            series[other_labels] = series.get(other_labels, 0.0) + other_link_rate
+        for labels, link_rate in series.items():
+            metric.add_metric(labels, link_rate)
+
+    def device_metric(self, name: str, documentation: str) -> GaugeMetricFamily:
+        return GaugeMetricFamily(
+            name,
+            documentation,
+            unit="MHz",
+            labels=self.device_labels,
+        )
 
     def extract(self, raw_htmls: Dict[str, bytes]) -> Iterable[Metric]:
         self.logger.debug("OverviewExtractor")
@@ -49,13 +150,14 @@ class OverviewExtractor(HtmlMetricsExtractor):
             return
 
         # extract json from javascript
-        json_lan_devices= re.search(r".*json_lanAttachedDevice = (.+);.*", raw_html)[1]
-        json_prim_wlan_devices = re.search(r".*json_primaryWlanAttachedDevice = (.+);.*", raw_html)[1]
-        json_guest_wlan_devices = re.search(r".*json_guestWlanAttachedDevice = (.+);.*", raw_html)[1]
+        js_vars = self.js_vars(raw_html)
+        json_lan_devices= js_vars['json_lanAttachedDevice']
+        json_prim_wlan_devices = js_vars['json_primaryWlanAttachedDevice']
+        json_guest_wlan_devices = js_vars['json_guestWlanAttachedDevice']
 
-        lan_host_nums = re.search(r".*js_lanHostNums = '(.+)';.*", raw_html)[1]
-        prim_wlan_host_nums = re.search(r".*js_primaryWlanHostNums = '(.+)';.*", raw_html)[1]
-        guest_wlan_host_nums = re.search(r".*js_guestWlanHostNums = '(.+)';.*", raw_html)[1]
+        lan_host_nums = js_vars['js_lanHostNums']
+        prim_wlan_host_nums = js_vars['js_primaryWlanHostNums']
+        guest_wlan_host_nums = js_vars['js_guestWlanHostNums']
 
         yield GaugeMetricFamily(
             "tg3442de_lan_host_nums",
@@ -77,45 +179,48 @@ class OverviewExtractor(HtmlMetricsExtractor):
         )
 
         # parse json
-        lan_devices = json.loads(json_lan_devices)
-        prim_wlan_devices = json.loads(json_prim_wlan_devices)
-        guest_wlan_devices = json.loads(json_guest_wlan_devices)
+        lan_devices = self.json_loads(json_lan_devices)
+        prim_wlan_devices = self.json_loads(json_prim_wlan_devices)
+        guest_wlan_devices = self.json_loads(json_guest_wlan_devices)
+
+        now = time.time()
+        self.registry.expire(now)
+        self.dropped_series = Counter()
 
         # set up ethernet user speed metric
-        lan_speed = GaugeMetricFamily(
-            "tg3442de_lan_speed",
-            "Ethernet client network speed",
-            unit="MHz",
-            labels=['index','hostname','MAC','IPv4','IPv6'],
-        )
-        self.add_devices(lan_devices, lan_speed,'Speed')
+        lan_speed = self.device_metric("tg3442de_lan_speed", "Ethernet client network speed")
+        self.add_devices(lan_devices, lan_speed,'Speed', now)
         yield from [lan_speed]
 
         # set up primary wifi user linkrate  metric
-        prim_wlan_linkrate = GaugeMetricFamily(
-            "tg3442de_primary_wlan_linkrate",
-            "Primary WLAN client link rate",
-            unit="MHz",
-            labels=['index','hostname','MAC','IPv4','IPv6'],
-        )
-        self.add_devices(prim_wlan_devices, prim_wlan_linkrate,'LinkRate')
+        prim_wlan_linkrate = self.device_metric("tg3442de_primary_wlan_linkrate", "Primary WLAN client link rate")
+        self.add_devices(prim_wlan_devices, prim_wlan_linkrate,'LinkRate', now)
         yield from [prim_wlan_linkrate]
 
         # set up guest wifi user linkrate  metric
-        guest_wlan_linkrate = GaugeMetricFamily(
-            "tg3442de_guest_wlan_linkrate",
-            "Guest WLAN client link rate",
-            unit="MHz",
-            labels=['index','hostname','MAC','IPv4','IPv6'],
-        )
-        self.add_devices(guest_wlan_devices, guest_wlan_linkrate,'LinkRate')
+        guest_wlan_linkrate = self.device_metric("tg3442de_guest_wlan_linkrate", "Guest WLAN client link rate")
+        self.add_devices(guest_wlan_devices, guest_wlan_linkrate,'LinkRate', now)
         yield from [guest_wlan_linkrate]
 
-        cm_operational    = self.re_search(r".*js_isCmOperational = '(.*)';.*",raw_html,1)[0]
-        prim_wifi_enable  = self.re_search(r".*js_wifiEnable = '(.*)';.*",raw_html,1)[0]
-        guest_wifi_enable = self.re_search(r".*js_guestWifiEnable = '(.*)';.*",raw_html,1)[0]
-        wps_enable        = self.re_search(r".*js_wpsEnable = '(.*)';.*",raw_html,1)[0]
-        schedule_enable   = self.re_search(r".*js_scheduleEnable = '(.*)';.*",raw_html,1)[0]
+        dropped_series = GaugeMetricFamily(
+            "tg3442de_overview_dropped_series",
+            "Number of device series left out by the cardinality policy in the last extraction, by reason",
+            labels=['reason'],
+        )
+        for reason in ['registry', 'top_n', 'labels']:
+            dropped_series.add_metric([reason], self.dropped_series[reason])
+        yield dropped_series
+        yield GaugeMetricFamily(
+            "tg3442de_overview_registered_devices",
+            "Number of devices in the device registry",
+            value=len(self.registry),
+        )
+
+        cm_operational    = js_vars.get('js_isCmOperational', 'Unknown')
+        prim_wifi_enable  = js_vars.get('js_wifiEnable', 'Unknown')
+        guest_wifi_enable = js_vars.get('js_guestWifiEnable', 'Unknown')
+        wps_enable        = js_vars.get('js_wpsEnable', 'Unknown')
+        schedule_enable   = js_vars.get('js_scheduleEnable', 'Unknown')
 
         yield InfoMetricFamily(
             'tg3442de_device_status',
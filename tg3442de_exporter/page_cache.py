@@ -0,0 +1,85 @@
+import threading
+from concurrent.futures import Executor, Future, wait
+from typing import Callable, Dict, Iterable, Optional, Union
+
+from tg3442de_exporter.content_cache import content_digest
+
+
+class PageCache:
+    """
+    Per-scrape cache between the collector and TG3442DE.html_getter. Every page is fetched at most once
+    per scrape and its response is handed to all extractors working on that page.
+    """
+
+    def __init__(self, fetch: Callable[[str], str], executor: Optional[Executor] = None):
+        self._fetch = fetch
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._pages = {}  # type: Dict[str, Future]
+        self._digests = {}  # type: Dict[str, bytes]
+
+    def prefetch(self, pages: Iterable[str]):
+        """
+        Starts fetching all given pages at once if an executor is available, otherwise pages are fetched on first use
+        :param pages: pages to fetch
+        """
+        if self._executor is None:
+            return
+        with self._lock:
+            for page in pages:
+                if page not in self._pages:
+                    self._pages[page] = self._executor.submit(self._fetch, page)
+
+    def update(self, results: Dict[str, Union[str, BaseException]]):
+        """
+        Adds pages fetched elsewhere, e.g. on the asyncio event loop
+        :param results: page content or the exception raised while fetching, by page
+        """
+        with self._lock:
+            for page, result in results.items():
+                future = Future()
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+                self._pages[page] = future
+
+    def get(self, page: str) -> str:
+        """
+        Returns the page content, fetching it if it has not been fetched during this scrape yet
+        :param page: page to fetch
+        :return: page content
+        :raises: the exception raised while fetching the page
+        """
+        with self._lock:
+            future = self._pages.get(page)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._pages[page] = future
+        if owner:
+            try:
+                future.set_result(self._fetch(page))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def cancel(self):
+        """
+        Cancels prefetched pages not fetched yet and waits for the fetches still running, so the
+        session is not used anymore once this returns
+        """
+        with self._lock:
+            futures = list(self._pages.values())
+        wait([future for future in futures if not future.cancel()])
+
+    def digest(self, page: str) -> bytes:
+        """
+        Returns the hash of the page content, computed once per scrape
+        :param page: page fetched before by get()
+        """
+        digest = self._digests.get(page)
+        if digest is None:
+            digest = content_digest(self.get(page))
+            self._digests[page] = digest
+        return digest
@@ -19,9 +19,9 @@ class PhoneStatusExtractor(HtmlMetricsExtractor):
         )
         self.logger = logger
         self.vars = {
-            "telf_{}_number"     : r".*var js_TELF{}_Number = '(.*)';.*",
-            "telf_{}_call_state" : r".*var js_TELF{}_CallPState = '(.*)';.*",
-            "telf_{}_hook_state" : r".*var js_TELF{}_HookState = '(.*)';.*",
+            "telf_{}_number"     : "js_TELF{}_Number",
+            "telf_{}_call_state" : "js_TELF{}_CallPState",
+            "telf_{}_hook_state" : "js_TELF{}_HookState",
         }
 
     def extract(self, raw_htmls: Dict[str, bytes]) -> Iterable[Metric]:
@@ -32,8 +32,9 @@ class PhoneStatusExtractor(HtmlMetricsExtractor):
         if len(raw_html) < 10:
             return
 
+        js_vars = self.js_vars(raw_html)
         #var js_NumberOfLine = '2';
-        number_of_line = int(self.re_search(r".*var js_NumberOfLine = '(.*)';.*",raw_html,1,0)[0])
+        number_of_line = int(js_vars.get('js_NumberOfLine', 0))
         self.logger.debug("number_of_line :" + str(number_of_line))
 
         values = { 
@@ -41,8 +42,8 @@ class PhoneStatusExtractor(HtmlMetricsExtractor):
         }
 
         for line_no in range(1,number_of_line+1):
-            for k, p in self.vars.items():
-                values[k.format(line_no)] = self.re_search(p.format(line_no),raw_html,1)[0]
+            for k, v in self.vars.items():
+                values[k.format(line_no)] = js_vars.get(v.format(line_no), 'Unknown')
 
         yield InfoMetricFamily(
             'tg3442de_phone_status',
@@ -0,0 +1,83 @@
+import threading
+import time
+import traceback
+from logging import Logger
+from typing import Callable, Iterable, List
+
+from prometheus_client import Metric
+from prometheus_client.metrics_core import GaugeMetricFamily
+
+
+class TG3442DEPoller:
+    """
+    Polls the TG3442DE in a background thread on its own interval and keeps the parsed metric
+    families as a snapshot, so /metrics requests never touch the modem.
+    """
+
+    def __init__(self, logger: Logger, scrape: Callable[[], Iterable[Metric]], interval: float):
+        self.logger = logger
+        self.scrape = scrape
+        self.interval = interval
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._families = []  # type: List[Metric]
+        self._timestamp = None
+        self.generation = 0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="tg3442de-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def poll(self):
+        """
+        Runs one scrape and replaces the snapshot with its result
+        """
+        families = list(self.scrape())
+        with self._lock:
+            self._families = families
+            self._timestamp = time.time()
+            self.generation += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            pre_poll_time = time.time()
+            try:
+                self.poll()
+            except Exception:
+                self.logger.error(f"Background poll failed.\n{traceback.format_exc()}")
+            elapsed = time.time() - pre_poll_time
+            self._stop.wait(max(self.interval - elapsed, 0))
+
+    def families(self) -> List[Metric]:
+        """
+        Returns the metric families of the last poll, nothing until the first poll finished
+        :return: metric families
+        """
+        with self._lock:
+            return self._families
+
+    def age_metric(self) -> Iterable[Metric]:
+        """
+        Returns the age of the snapshot, nothing until the first poll finished
+        :return: metrics iterable
+        """
+        with self._lock:
+            timestamp = self._timestamp
+        if timestamp is None:
+            return
+        yield GaugeMetricFamily(
+            "tg3442de_snapshot_age",
+            "Age of the polled TG3442DE metrics snapshot",
+            unit="seconds",
+            value=time.time() - timestamp,
+        )
@@ -0,0 +1,114 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable
+
+# seconds between two stack samples
+SAMPLE_INTERVAL = 0.005
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profile is requested while another one is running"""
+
+
+class ScrapeProfiler:
+    """
+    Profiles scrapes and renderings of the metrics on request, while the exporter keeps running.
+    Scraping threads run their work through run(), which marks them as scraping and, while a
+    cProfile profile is taken, profiles them. Only one thread is profiled by cProfile at a time,
+    concurrent scrapes of other targets run unprofiled. The sampling profiler instead records the
+    stacks of all scraping threads, including the threads fetching pages.
+    """
+
+    def __init__(self):
+        # held while a profile is taken, one profile at a time
+        self._lock = threading.Lock()
+        # held by the thread profiled by cProfile
+        self._profile_lock = threading.Lock()
+        self._profile = None  # type: cProfile.Profile
+        # idents of the threads within run()
+        self._threads = set()
+
+    def run(self, function: Callable):
+        """
+        Calls function as scraping work of the current thread
+        :return: result of function
+        """
+        ident = threading.get_ident()
+        if ident in self._threads:
+            # nested, e.g. a scrape within the rendering of the metrics
+            return function()
+        self._threads.add(ident)
+        try:
+            profile = self._profile
+            if profile is not None and self._profile_lock.acquire(blocking=False):
+                try:
+                    return profile.runcall(function)
+                finally:
+                    self._profile_lock.release()
+            return function()
+        finally:
+            self._threads.discard(ident)
+
+    def profile(self, seconds: float) -> str:
+        """
+        Profiles scraping threads with cProfile for the given time
+        :return: pstats output sorted by cumulative time
+        :raises: ProfilerBusyError
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running")
+        try:
+            profile = self._profile = cProfile.Profile()
+            time.sleep(seconds)
+            self._profile = None
+            # wait for a profiled call still running
+            with self._profile_lock:
+                pass
+        finally:
+            self._lock.release()
+
+        output = io.StringIO()
+        try:
+            stats = pstats.Stats(profile, stream=output)
+        except TypeError:
+            # no data, Stats refuses empty profiles
+            return f"No scrape ran within {seconds} seconds\n"
+        stats.sort_stats("cumulative").print_stats()
+        return output.getvalue()
+
+    def sample(self, seconds: float) -> str:
+        """
+        Samples the stacks of scraping threads for the given time
+        :return: collapsed stacks, one 'outer;...;inner count' line per distinct stack
+        :raises: ProfilerBusyError
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already running")
+        stacks = Counter()  # type: Counter
+        try:
+            end = time.time() + seconds
+            while time.time() < end:
+                frames = sys._current_frames()
+                for ident in set(self._threads):
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[self._collapse(frame)] += 1
+                time.sleep(SAMPLE_INTERVAL)
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
@@ -0,0 +1,39 @@
+import threading
+from typing import Dict, List
+
+from prometheus_client import Metric
+
+
+class ExtractorScheduler:
+    """
+    Tracks per-extractor refresh intervals. Extractors which are not due yet are served from the
+    metric families of their last successful run, so their pages are not fetched from the TG3442DE.
+    """
+
+    def __init__(self, intervals: Dict[str, float]):
+        self.intervals = intervals
+        self._lock = threading.Lock()
+        self._last_run = {}  # type: Dict[str, float]
+        self._families = {}  # type: Dict[str, List[Metric]]
+
+    def is_due(self, name: str, now: float) -> bool:
+        """
+        An extractor is due if it never ran successfully or its interval (default: every scrape) passed
+        :param name: extractor name
+        :param now: current time
+        :return: True if the extractor has to query the TG3442DE
+        """
+        with self._lock:
+            last_run = self._last_run.get(name)
+        if last_run is None:
+            return True
+        return now - last_run >= self.intervals.get(name, 0)
+
+    def store(self, name: str, families: List[Metric], now: float):
+        with self._lock:
+            self._last_run[name] = now
+            self._families[name] = families
+
+    def cached(self, name: str) -> List[Metric]:
+        with self._lock:
+            return self._families.get(name, [])
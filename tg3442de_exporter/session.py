@@ -0,0 +1,122 @@
+import threading
+from logging import Logger
+from typing import Optional
+
+from tg3442de_exporter.latency import LatencyTracker
+from tg3442de_exporter.tg3442de import TG3442DE
+
+
+class TG3442DESession:
+    """
+    Hands out logged-in TG3442DE objects to the collector.
+
+    With keep_session enabled one TG3442DE (and its requests.Session with the CSRF nonce) is kept
+    across scrapes and only logged in again when the modem dropped the session. Otherwise every
+    scrape gets a fresh TG3442DE which is logged out again on release, like before.
+    """
+
+    def __init__(self, logger: Logger, ip_address: str, password: str, timeout, simulate: bool, keep_session: bool,
+                 latency: Optional[LatencyTracker] = None):
+        self.logger = logger
+        self.ip_address = ip_address
+        self.password = password
+        self.timeout = timeout
+        self.simulate = simulate
+        self.keep_session = keep_session
+        self.latency = latency
+
+        self._lock = threading.Lock()
+        self._relogin_lock = threading.Lock()
+        self._box = None
+
+        # number of logins performed and number of scrapes served by an already logged-in session
+        self.logins = 0
+        self.reuses = 0
+        # durations of the phases of the last login
+        self.login_timings = {}
+        # lookups of derived login keys by result
+        self.key_cache_stats = {"hits": 0, "misses": 0}
+
+    def _new_box(self) -> TG3442DE:
+        return TG3442DE(
+            self.logger, self.ip_address, key=self.password, timeout=self.timeout, simulate=self.simulate,
+            latency=self.latency, key_cache_stats=self.key_cache_stats,
+        )
+
+    def _login(self, box: TG3442DE):
+        with self._lock:
+            self.logins += 1
+        try:
+            if not box.login():
+                raise ValueError(f"Login to {self.ip_address} failed")
+        finally:
+            self.login_timings = box.login_timings
+
+    def acquire(self) -> TG3442DE:
+        """
+        Returns a logged-in TG3442DE, reusing the kept session if possible
+        :return: TG3442DE
+        :raises: ValueError if the login failed
+        """
+        if not self.keep_session:
+            box = self._new_box()
+            self._login(box)
+            return box
+
+        with self._lock:
+            if self._box is None:
+                self._box = self._new_box()
+            box = self._box
+            reuse = box.logged_in
+            if reuse:
+                self.reuses += 1
+        if not reuse:
+            # scrapes and the DOCSIS sampler share the kept session, only the first one logs in
+            with self._relogin_lock:
+                if box.logged_in:
+                    with self._lock:
+                        self.reuses += 1
+                else:
+                    self._login(box)
+        return box
+
+    def html_getter(self, box: TG3442DE, page: str) -> str:
+        """
+        Fetches a page and logs in again once if the modem answered with an expired session
+        :param box: TG3442DE obtained by acquire()
+        :param page: page to fetch
+        :return: page content
+        """
+        raw_html = box.html_getter(page, "")
+        if not box.logged_in:
+            # pages may be fetched concurrently, only the first one noticing the expired session logs in
+            with self._relogin_lock:
+                if not box.logged_in:
+                    self.logger.info(f"Session expired while querying page={page}, logging in again")
+                    self._login(box)
+            raw_html = box.html_getter(page, "")
+        return raw_html
+
+    def release(self, box: TG3442DE):
+        """
+        Logs out unless the session is kept for the next scrape
+        :param box: TG3442DE obtained by acquire()
+        """
+        if not self.keep_session:
+            box.logout()
+
+    def invalidate(self):
+        """
+        Forgets the kept session, e.g. after connection errors, so the next scrape logs in again
+        """
+        with self._lock:
+            self._box = None
+
+    def close(self):
+        """
+        Logs out the kept session on shutdown
+        """
+        with self._lock:
+            box, self._box = self._box, None
+        if box is not None and box.logged_in:
+            box.logout()
@@ -0,0 +1,63 @@
+import threading
+from typing import Callable, List
+
+from prometheus_client import Metric
+
+
+class _Flight:
+    __slots__ = ["done", "result", "error"]
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Runs at most one call at a time. Callers arriving while a call is running wait for it,
+    at most max_wait seconds, and share its result instead of starting another one.
+    """
+
+    def __init__(self, max_wait: float):
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._flight = None
+        # number of callers served by the call of another caller, and of callers giving up waiting
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, function: Callable[[], List[Metric]]) -> List[Metric]:
+        """
+        :param function: call to run or to join
+        :return: result of the call
+        :raises: TimeoutError if the running call did not finish within max_wait,
+                 the exception raised by the call
+        """
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                flight.result = function()
+            except BaseException as e:
+                flight.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._flight = None
+                flight.done.set()
+            return flight.result
+
+        if not flight.done.wait(self.max_wait):
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError(f"Running collection did not finish within {self.max_wait}s")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
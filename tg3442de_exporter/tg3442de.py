@@ -1,88 +1,161 @@
 import binascii
+from collections import OrderedDict
 from Crypto.Cipher import AES
 import hashlib
 import json
 import re
 import requests
 import sys
+import threading
+import time
+
+# the login page is served instead of the requested data page once the modem dropped the session
+LOGIN_PAGE_MARKER = "var mySalt"
+
+LOGIN_ASSOCIATED_DATA = "loginPassword"
+
+# keys derived by PBKDF2 by (password hash, salt), the salt usually stays the same between logins
+DERIVED_KEY_CACHE_SIZE = 64
+_derived_keys = OrderedDict()
+_derived_keys_lock = threading.Lock()
+
+
+def parse_login_page(text):
+    # get session id, iv and salt from javascript in head
+    current_session_id = re.search(r".*var currentSessionId = '(.+)';.*", text)[1]
+    iv = re.search(r".*var myIv = '(.+)';.*",text)[1]
+    salt = re.search(r".*var mySalt = '(.+)';.*",text)[1]
+    return current_session_id, iv, salt
+
+
+def derive_key(password, salt, stats=None):
+    # stats: optional dict counting cache 'hits' and 'misses'
+    cache_key = (hashlib.sha256(password.encode("utf-8")).digest(), salt)
+    with _derived_keys_lock:
+        key = _derived_keys.get(cache_key)
+        if key is not None:
+            _derived_keys.move_to_end(cache_key)
+            if stats is not None:
+                stats["hits"] += 1
+            return key
+        if stats is not None:
+            stats["misses"] += 1
+
+    key = hashlib.pbkdf2_hmac(
+        'sha256',
+        bytes(password.encode("ascii")),
+        binascii.unhexlify(salt),
+        iterations=1000,
+        dklen=16
+    )
+
+    with _derived_keys_lock:
+        _derived_keys[cache_key] = key
+        while len(_derived_keys) > DERIVED_KEY_CACHE_SIZE:
+            _derived_keys.popitem(last=False)
+    return key
+
+
+def encrypt_password(username, password, current_session_id, iv, key):
+    secret = { "Password": password, "Nonce": current_session_id }
+    plaintext = bytes(json.dumps(secret).encode("ascii"))
+
+    # initialize cipher
+    cipher = AES.new(key, AES.MODE_CCM, binascii.unhexlify(iv))
+    # set associated data
+    cipher.update(bytes(LOGIN_ASSOCIATED_DATA.encode("ascii")))
+    # encrypt plaintext
+    encrypt_data = cipher.encrypt(plaintext)
+    # append digest
+    encrypt_data += cipher.digest()
+    # return
+    login_data = {
+        'EncryptData': binascii.hexlify(encrypt_data).decode("ascii"),
+        'Name': username,
+        'AuthData': LOGIN_ASSOCIATED_DATA
+    }
+    return login_data
+
+
+def decrypt_csrf_nonce(key, iv, text):
+    result = json.loads(text)
+    encryptData = result['encryptData']
+    cipher = AES.new(key, AES.MODE_CCM, binascii.unhexlify(iv))
+    plain_data = cipher.decrypt(binascii.unhexlify(encryptData))
+    return plain_data[:32]
+
+
+def read_simulated_page(logger, page):
+    partname = page[5:page.find('.php')]
+    filename = f"simulate/{partname}.txt"
+    result = ''
+    try:
+        with open(filename) as f:
+            result = f.read()
+    except FileNotFoundError:
+        logger.error("FileNotFound:"+filename)
+    return result
+
 
 class TG3442DE():
-    def __init__(self,logger, address, key, timeout,simulate=False):
+    def __init__(self,logger, address, key, timeout,simulate=False, latency=None, key_cache_stats=None):
         self.logger = logger
-        self.logger.debug("__init__")        
+        self.logger.debug("__init__")
         self.ip_address = address
         self.url = 'http://' + address
         self.username = 'admin'
         self.password = key
         self.timeout = timeout
+        # optional LatencyTracker giving adaptive timeouts
+        self.latency = latency
+        # optional dict counting lookups of derived login keys, shared by the boxes of a session
+        self.key_cache_stats = key_cache_stats
         self.simulate = simulate
         self.session = requests.Session()
+        self.logged_in = False
+        # durations of the phases of the last login
+        self.login_timings = {}
         if (self.simulate):
             self.logger.info("Simulating Device Access")
-        
+
 
     def login(self):
         self.logger.debug("TG3442DE Logging in at " + self.ip_address)
+        self.logged_in = False
+        self.login_timings = {}
         if self.simulate == False:
+            phase_start = time.time()
             # get login page
-            r = self.session.get(f"{self.url}",timeout=self.timeout)
+            r = self._request("GET", f"{self.url}")
             # parse HTML
-            # get session id from javascript in head
-            current_session_id = re.search(r".*var currentSessionId = '(.+)';.*", r.text)[1]
+            current_session_id, iv, salt = parse_login_page(r.text)
+            phase_start = self._login_phase("page_fetch", phase_start)
 
             # encrypt password
-            iv = re.search(r".*var myIv = '(.+)';.*",r.text)[1]
-            salt = re.search(r".*var mySalt = '(.+)';.*",r.text)[1]
-            key = hashlib.pbkdf2_hmac(
-                'sha256',
-                bytes(self.password.encode("ascii")),
-                binascii.unhexlify(salt),
-                iterations=1000,
-                dklen=16
-            )
-
-            secret = { "Password": self.password, "Nonce": current_session_id }
-            plaintext = bytes(json.dumps(secret).encode("ascii"))
-            associated_data = "loginPassword"
-            
-            # initialize cipher
-            cipher = AES.new(key, AES.MODE_CCM, binascii.unhexlify(iv))
-            # set associated data
-            cipher.update(bytes(associated_data.encode("ascii")))
-            # encrypt plaintext
-            encrypt_data = cipher.encrypt(plaintext)
-            # append digest
-            encrypt_data += cipher.digest()
-            # return
-            login_data = {
-                'EncryptData': binascii.hexlify(encrypt_data).decode("ascii"),
-                'Name': self.username,
-                'AuthData': associated_data
-            }
+            key = derive_key(self.password, salt, self.key_cache_stats)
+            phase_start = self._login_phase("kdf", phase_start)
+            login_data = encrypt_password(self.username, self.password, current_session_id, iv, key)
+            phase_start = self._login_phase("encrypt", phase_start)
 
             # login
-            r = self.session.post(
+            r = self._request(
+                "POST",
                 f"{self.url}/php/ajaxSet_Password.php",
                 headers={
                     "Content-Type": "application/json",
                 },
                 data=json.dumps(login_data),
-                timeout=self.timeout
             )
 
             # parse result
             # success?
             if r.text.find("AdminMatch") == -1:
                 self.logger.info("login failure")
-                return
-
-            result = json.loads(r.text)
+                return False
 
             # remember CSRF nonce
-            encryptData = result['encryptData']
-            cipher = AES.new(key, AES.MODE_CCM, binascii.unhexlify(iv))
-            plain_data = cipher.decrypt(binascii.unhexlify(encryptData))
-            csrf_nonce = plain_data[:32]
+            csrf_nonce = decrypt_csrf_nonce(key, iv, r.text)
+            phase_start = self._login_phase("post", phase_start)
 
             # prepare headers
             self.session.headers.update({
@@ -93,37 +166,55 @@ class TG3442DE():
 
             # set credentials cookie
             # TODO: get credentials from /base_95x.js'
- 
+
             # set session
-            r = self.session.post(f"{self.url}/php/ajaxSet_Session.php",timeout=self.timeout)
+            r = self._request("POST", f"{self.url}/php/ajaxSet_Session.php")
+            self._login_phase("session_set", phase_start)
+
+        self.logged_in = True
+        return True
 
+    def _request(self, method, url, **kwargs):
+        if self.latency is None:
+            return self.session.request(method, url, timeout=self.timeout, **kwargs)
+        timeout = self.latency.timeout()
+        start = time.time()
+        try:
+            return self.session.request(method, url, timeout=timeout, **kwargs)
+        finally:
+            # timed out requests count with the timeout, raising the next timeouts
+            self.latency.observe(time.time() - start)
+
+    def _login_phase(self, phase, phase_start):
+        now = time.time()
+        self.login_timings[phase] = now - phase_start
+        return now
 
 
     def logout(self):
         self.logger.debug("TG3442DE Logging out ")
         if self.simulate == False:
-            r = self.session.post(
+            r = self._request(
+                "POST",
                 f"{self.url}/php/logout.php",
                 headers={
                     "Content-Type": "application/x-www-form-urlencoded",
-                },timeout=self.timeout
+                },
             )
+        self.logged_in = False
 
     def html_getter(self, page, result):
         self.logger.debug("TG3442DE Page :" + page)
         result = ''
         if self.simulate == False:
-            r = self.session.get(f"{self.url}{page}",timeout=self.timeout)
+            r = self._request("GET", f"{self.url}{page}")
             if r != None:
-                if int(r.status_code) == 200:
+                if int(r.status_code) in (401, 403) or r.text.find(LOGIN_PAGE_MARKER) != -1:
+                    self.logger.info("TG3442DE session expired")
+                    self.logged_in = False
+                elif int(r.status_code) == 200:
                     result = r.text
         else:
-            partname = page[5:page.find('.php')]
-            filename = f"simulate/{partname}.txt"
-            try:
-                with open(filename) as f:
-                    result = f.read()
-            except FileNotFoundError:
-                self.logger.error("FileNotFound:"+filename)
-
-        return result
\ No newline at end of file
+            result = read_simulated_page(self.logger, page)
+
+        return result
@@ -0,0 +1,317 @@
+import asyncio
+import json
+import threading
+import time
+from logging import Logger
+from typing import Dict, Iterable, Optional, Union
+
+import aiohttp
+
+from tg3442de_exporter.latency import LatencyTracker
+from tg3442de_exporter.tg3442de import (
+    LOGIN_PAGE_MARKER,
+    parse_login_page,
+    derive_key,
+    encrypt_password,
+    decrypt_csrf_nonce,
+    read_simulated_page,
+)
+
+
+class AsyncTG3442DE():
+    """
+    asyncio variant of TG3442DE with the same login/logout/html_getter surface. Requests share one
+    aiohttp connection pool with keep-alive connections to the modem.
+    """
+
+    def __init__(self, logger, address, key, timeout, simulate=False, latency=None, key_cache_stats=None):
+        self.logger = logger
+        self.ip_address = address
+        self.url = 'http://' + address
+        self.username = 'admin'
+        self.password = key
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        # optional LatencyTracker giving adaptive timeouts
+        self.latency = latency
+        # optional dict counting lookups of derived login keys, shared by the boxes of a session
+        self.key_cache_stats = key_cache_stats
+        self.simulate = simulate
+        self.logged_in = False
+        self.headers = {}
+        # durations of the phases of the last login
+        self.login_timings = {}
+        # cookies of hosts given by IP address are only accepted by an unsafe cookie jar
+        self.session = aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True), timeout=self.timeout)
+        if (self.simulate):
+            self.logger.info("Simulating Device Access")
+
+    async def login(self):
+        self.logger.debug("AsyncTG3442DE Logging in at " + self.ip_address)
+        self.logged_in = False
+        self.login_timings = {}
+        if self.simulate == False:
+            phase_start = time.time()
+            # get login page
+            _, text = await self._request("GET", f"{self.url}")
+            current_session_id, iv, salt = parse_login_page(text)
+            phase_start = self._login_phase("page_fetch", phase_start)
+
+            # encrypt password
+            key = derive_key(self.password, salt, self.key_cache_stats)
+            phase_start = self._login_phase("kdf", phase_start)
+            login_data = encrypt_password(self.username, self.password, current_session_id, iv, key)
+            phase_start = self._login_phase("encrypt", phase_start)
+
+            # login
+            _, text = await self._request(
+                "POST",
+                f"{self.url}/php/ajaxSet_Password.php",
+                headers={
+                    "Content-Type": "application/json",
+                },
+                data=json.dumps(login_data),
+            )
+
+            # success?
+            if text.find("AdminMatch") == -1:
+                self.logger.info("login failure")
+                return False
+
+            # remember CSRF nonce
+            csrf_nonce = decrypt_csrf_nonce(key, iv, text)
+            phase_start = self._login_phase("post", phase_start)
+            self.headers = {
+                "X-Requested-With": "XMLHttpRequest",
+                "csrfNonce": csrf_nonce.decode("ascii", errors="replace"),
+                "Origin": f"{self.url}/",
+            }
+
+            # set session
+            await self._request("POST", f"{self.url}/php/ajaxSet_Session.php", headers=self.headers)
+            self._login_phase("session_set", phase_start)
+
+        self.logged_in = True
+        return True
+
+    async def _request(self, method, url, **kwargs):
+        """
+        :return: status and text of the response
+        """
+        if self.latency is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=self.latency.adaptive_timeout())
+        start = time.time()
+        try:
+            async with self.session.request(method, url, **kwargs) as r:
+                return r.status, await r.text()
+        finally:
+            if self.latency is not None:
+                # timed out requests count with the timeout, raising the next timeouts
+                self.latency.observe(time.time() - start)
+
+    def _login_phase(self, phase, phase_start):
+        now = time.time()
+        self.login_timings[phase] = now - phase_start
+        return now
+
+    async def logout(self):
+        self.logger.debug("AsyncTG3442DE Logging out ")
+        if self.simulate == False:
+            headers = dict(self.headers)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+            await self._request("POST", f"{self.url}/php/logout.php", headers=headers)
+        self.logged_in = False
+
+    async def html_getter(self, page, result):
+        self.logger.debug("AsyncTG3442DE Page :" + page)
+        result = ''
+        if self.simulate == False:
+            status, text = await self._request("GET", f"{self.url}{page}", headers=self.headers)
+            if status in (401, 403) or text.find(LOGIN_PAGE_MARKER) != -1:
+                self.logger.info("AsyncTG3442DE session expired")
+                self.logged_in = False
+            elif status == 200:
+                result = text
+        else:
+            result = read_simulated_page(self.logger, page)
+
+        return result
+
+    async def close(self):
+        await self.session.close()
+
+
+class EventLoopThread:
+    """
+    Runs one asyncio event loop in a background thread. Blocking callers (the collector threads of the
+    HTTP server) submit coroutines to it, so page fetches of all modems share a single loop.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="tg3442de-asyncio", daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+_event_loop_thread = None
+_event_loop_thread_lock = threading.Lock()
+
+
+def get_event_loop_thread() -> EventLoopThread:
+    global _event_loop_thread
+    with _event_loop_thread_lock:
+        if _event_loop_thread is None:
+            _event_loop_thread = EventLoopThread()
+        return _event_loop_thread
+
+
+class AsyncTG3442DESession:
+    """
+    Counterpart of TG3442DESession for AsyncTG3442DE. All network I/O runs on the shared event loop
+    thread; the blocking methods mirror TG3442DESession so the collector can use either.
+    """
+
+    def __init__(self, logger: Logger, ip_address: str, password: str, timeout, simulate: bool, keep_session: bool,
+                 fetch_concurrency: int, latency: Optional[LatencyTracker] = None):
+        self.logger = logger
+        self.ip_address = ip_address
+        self.password = password
+        self.timeout = timeout
+        self.simulate = simulate
+        self.keep_session = keep_session
+        self.fetch_concurrency = fetch_concurrency
+        self.latency = latency
+        self.event_loop = get_event_loop_thread()
+
+        self._box = None
+        self._relogin_lock = None
+
+        # number of logins performed and number of scrapes served by an already logged-in session
+        self.logins = 0
+        self.reuses = 0
+        # durations of the phases of the last login
+        self.login_timings = {}
+        # lookups of derived login keys by result
+        self.key_cache_stats = {"hits": 0, "misses": 0}
+
+    def _run(self, coroutine):
+        # the scrape deadline is set for the calling thread, not for the event loop thread
+        remaining = self.latency.remaining() if self.latency is not None else None
+        if remaining is not None:
+            if remaining <= 0:
+                coroutine.close()
+                raise ConnectionError("Scrape deadline exceeded")
+            coroutine = asyncio.wait_for(coroutine, remaining)
+        try:
+            return self.event_loop.run(coroutine)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise ConnectionError(repr(e)) from e
+
+    async def _login(self, box: AsyncTG3442DE):
+        self.logins += 1
+        try:
+            if not await box.login():
+                raise ValueError(f"Login to {self.ip_address} failed")
+        finally:
+            self.login_timings = box.login_timings
+
+    async def _acquire(self) -> AsyncTG3442DE:
+        if not self.keep_session:
+            box = AsyncTG3442DE(self.logger, self.ip_address, self.password, self.timeout, self.simulate,
+                                      self.latency, self.key_cache_stats)
+            try:
+                await self._login(box)
+            except BaseException:
+                await box.close()
+                raise
+            return box
+
+        if self._box is None:
+            self._box = AsyncTG3442DE(self.logger, self.ip_address, self.password, self.timeout, self.simulate,
+                                      self.latency, self.key_cache_stats)
+        box = self._box
+        if box.logged_in or not await self._relogin(box):
+            self.reuses += 1
+        return box
+
+    async def _relogin(self, box: AsyncTG3442DE) -> bool:
+        """
+        :return: whether this call logged in
+        """
+        # scrapes, pages and the DOCSIS sampler run concurrently, only the first one noticing the missing session logs in
+        if self._relogin_lock is None:
+            self._relogin_lock = asyncio.Lock()
+        async with self._relogin_lock:
+            if box.logged_in:
+                return False
+            await self._login(box)
+            return True
+
+    async def _html_getter(self, box: AsyncTG3442DE, page: str) -> str:
+        raw_html = await box.html_getter(page, "")
+        if not box.logged_in:
+            self.logger.info(f"Session expired while querying page={page}, logging in again")
+            await self._relogin(box)
+            raw_html = await box.html_getter(page, "")
+        return raw_html
+
+    async def _fetch_pages(self, box: AsyncTG3442DE, pages: Iterable[str], fetch_duration: Dict[str, float]):
+        semaphore = asyncio.Semaphore(self.fetch_concurrency)
+
+        async def fetch(page):
+            async with semaphore:
+                self.logger.debug(f"Querying page={page}...")
+                pre_fetch_time = time.time()
+                raw_html = await self._html_getter(box, page)
+                fetch_duration[page] = time.time() - pre_fetch_time
+                return raw_html
+
+        pages = list(pages)
+        results = await asyncio.gather(*[fetch(page) for page in pages], return_exceptions=True)
+        return dict(zip(pages, results))
+
+    async def _release(self, box: AsyncTG3442DE):
+        if not self.keep_session:
+            try:
+                await box.logout()
+            finally:
+                await box.close()
+
+    async def _invalidate(self):
+        box, self._box = self._box, None
+        if box is not None:
+            await box.close()
+
+    async def _close(self):
+        box, self._box = self._box, None
+        if box is not None:
+            try:
+                if box.logged_in:
+                    await box.logout()
+            finally:
+                await box.close()
+
+    def acquire(self) -> AsyncTG3442DE:
+        return self._run(self._acquire())
+
+    def html_getter(self, box: AsyncTG3442DE, page: str) -> str:
+        return self._run(self._html_getter(box, page))
+
+    def fetch_pages(self, box: AsyncTG3442DE, pages: Iterable[str], fetch_duration: Dict[str, float]
+                    ) -> Dict[str, Union[str, BaseException]]:
+        """
+        Fetches all pages on the event loop, at most fetch_concurrency at the same time
+        :return: page content or the exception raised while fetching, by page
+        """
+        return self._run(self._fetch_pages(box, pages, fetch_duration))
+
+    def release(self, box: AsyncTG3442DE):
+        self._run(self._release(box))
+
+    def invalidate(self):
+        self._run(self._invalidate())
+
+    def close(self):
+        self._run(self._close())
@@ -11,32 +11,72 @@ tg3442de_exporter Prometheus Plugin to monitor status of Arris TG3442DE
 '''
 
 import logging
+import signal
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer
 from socketserver import ThreadingMixIn
-from typing import Dict
+from typing import Dict, Iterable, List, Optional
 import traceback
 import logging
 
 import click
-from prometheus_client import CollectorRegistry, MetricsHandler
-from prometheus_client.metrics_core import GaugeMetricFamily
-from requests import Timeout
+from prometheus_client import CollectorRegistry, Metric
+from prometheus_client.metrics_core import GaugeMetricFamily, CounterMetricFamily
+from requests import RequestException
 
-from tg3442de_exporter.tg3442de import TG3442DE
+from tg3442de_exporter.session import TG3442DESession
+from tg3442de_exporter.poller import TG3442DEPoller
+from tg3442de_exporter.scheduler import ExtractorScheduler
+from tg3442de_exporter.page_cache import PageCache
+from tg3442de_exporter.content_cache import ContentCache
+from tg3442de_exporter.single_flight import SingleFlight
+from tg3442de_exporter.latency import LatencyTracker
+from tg3442de_exporter.circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from tg3442de_exporter.instrumentation import ScrapeInstrumentation
+from tg3442de_exporter.profiler import ScrapeProfiler
+from tg3442de_exporter.docsis_sampler import DocsisSampler
+from tg3442de_exporter.docsis_status_extractor import DOCSIS_STATUS
+from tg3442de_exporter.multi_target import MultiTargetCollector
+from tg3442de_exporter.handler import TG3442DEMetricsHandler
+from tg3442de_exporter.exposition_cache import ExpositionCache
 from tg3442de_exporter.config import (
     load_config,
+    target_exporter_config,
     IP_ADDRESS,
     PASSWORD,
+    TARGETS,
+    TARGET_NAME,
+    MAX_CONCURRENT_TARGETS,
     EXPORTER,
     PORT,
     TIMEOUT_SECONDS,
     EXTRACTORS,
-    SIMULATE
+    SIMULATE,
+    KEEP_SESSION,
+    POLL_INTERVAL,
+    EXTRACTOR_INTERVALS,
+    FETCH_CONCURRENCY,
+    ASYNC_CLIENT,
+    LOG_COMPACTION_INTERVAL,
+    DOCSIS_SAMPLE_INTERVAL,
+    DOCSIS_SAMPLE_WINDOW,
+    COALESCE_MAX_WAIT,
+    SCRAPE_DEADLINE,
+    ADAPTIVE_TIMEOUT,
+    BREAKER_FAILURES,
+    BREAKER_BACKOFF,
+    BREAKER_MAX_BACKOFF,
+    OPENMETRICS,
+    DEBUG_ENDPOINTS,
+    LOG_ENDPOINTS,
+    SCRAPE_HISTORY,
 )
 
 from tg3442de_exporter.html2metric import get_metrics_extractor
+from tg3442de_exporter.call_log_local_extractor import CALL_LOG_LOCAL
+from tg3442de_exporter.event_log_local_extractor import EVENT_LOG_LOCAL
 
 # Taken 1:1 from prometheus-client==0.7.1, see https://github.com/prometheus/client_python/blob/3cb4c9247f3f08dfbe650b6bdf1f53aa5f6683c1/prometheus_client/exposition.py
 class _ThreadingSimpleServer(ThreadingMixIn, HTTPServer):
@@ -56,82 +96,349 @@ class TG3442DECollector(object):
         ip_address: str,
         password: str,
         exporter_config: Dict,
+        profiler: Optional[ScrapeProfiler] = None,
     ):
         self.logger = logger
         self.ip_address = ip_address
         self.password = password
         self.timeout = exporter_config[TIMEOUT_SECONDS]
         self.simulate = (exporter_config[SIMULATE] == 1)
+        self.async_client = (exporter_config[ASYNC_CLIENT] == 1)
+        # request timeouts adapt to the measured latency, within the deadline of the scrape
+        self.latency = LatencyTracker(self.timeout, adaptive=(exporter_config[ADAPTIVE_TIMEOUT] == 1))
+        self.scrape_deadline = exporter_config[SCRAPE_DEADLINE]
+        if self.async_client:
+            # aiohttp is only required for the asyncio client
+            from tg3442de_exporter.tg3442de_async import AsyncTG3442DESession
+            self.session = AsyncTG3442DESession(
+                logger, ip_address, password, self.timeout, self.simulate,
+                keep_session=(exporter_config[KEEP_SESSION] == 1),
+                fetch_concurrency=exporter_config[FETCH_CONCURRENCY],
+                latency=self.latency,
+            )
+        else:
+            self.session = TG3442DESession(
+                logger, ip_address, password, self.timeout, self.simulate,
+                keep_session=(exporter_config[KEEP_SESSION] == 1),
+                latency=self.latency,
+            )
 
         extractors = exporter_config[EXTRACTORS]
         self.metric_extractors = [get_metrics_extractor(e, logger,exporter_config) for e in extractors]
+        self.scheduler = ExtractorScheduler(exporter_config[EXTRACTOR_INTERVALS])
+        self.content_cache = ContentCache()
+        self.instrumentation = ScrapeInstrumentation(exporter_config[SCRAPE_HISTORY])
+        # profiler shared by all targets, scrapes run through it to be profiled on request
+        self.profiler = profiler if profiler is not None else ScrapeProfiler()
+
+        # optional concurrent page fetching, bounded to not overload the modem
+        self.fetch_executor = None
+        if exporter_config[FETCH_CONCURRENCY] > 1 and not self.async_client:
+            self.fetch_executor = ThreadPoolExecutor(
+                max_workers=exporter_config[FETCH_CONCURRENCY], thread_name_prefix="tg3442de-fetch"
+            )
+
+        self.log_compaction_interval = exporter_config[LOG_COMPACTION_INTERVAL]
+
+        # concurrent requests share one scrape instead of each logging in to the TG3442DE
+        self.single_flight = SingleFlight(exporter_config[COALESCE_MAX_WAIT])
+
+        # an unresponsive TG3442DE is not scraped for a while, the last successful metrics are served instead
+        self.breaker = CircuitBreaker(
+            exporter_config[BREAKER_FAILURES], exporter_config[BREAKER_BACKOFF], exporter_config[BREAKER_MAX_BACKOFF]
+        )
+        self.scrape_failed = False
+        self.last_good = []  # type: List[Metric]
+        self.extracted = []  # type: List[Metric]
+        self.stale = False
+
+        # optional background polling, /metrics is then served from the last snapshot
+        self.poller = None
+        if exporter_config[POLL_INTERVAL] > 0:
+            self.poller = TG3442DEPoller(logger, self.guarded_scrape, exporter_config[POLL_INTERVAL])
+
+        # optional sampling of DOCSIS channels in between scrapes
+        self.docsis_sampler = None
+        docsis_extractors = [e for e in self.metric_extractors if e.name == DOCSIS_STATUS]
+        if exporter_config[DOCSIS_SAMPLE_INTERVAL] > 0 and docsis_extractors:
+            self.docsis_sampler = DocsisSampler(
+                logger, self.session, docsis_extractors[0],
+                exporter_config[DOCSIS_SAMPLE_INTERVAL], exporter_config[DOCSIS_SAMPLE_WINDOW], self.breaker,
+            )
+
+    def start(self):
+        """
+        Starts background polling and DOCSIS sampling if configured and the compaction of local log stores
+        """
+        if self.poller is not None:
+            self.poller.start()
+        if self.docsis_sampler is not None:
+            self.docsis_sampler.start()
+        for store in self.log_stores().values():
+            store.start(self.log_compaction_interval)
+
+    @property
+    def generation(self) -> Optional[int]:
+        """
+        Number of the polled snapshot, None if every collection scrapes the TG3442DE
+        """
+        return self.poller.generation if self.poller is not None else None
+
+    def collect_cacheable(self):
+        """
+        Metrics which only change with the generation
+        """
+        if self.poller is not None:
+            yield from self.poller.families()
+        else:
+            try:
+                yield from self.single_flight.do(self.guarded_scrape)
+            except TimeoutError as e:
+                self.logger.warning(repr(e))
+
+    def collect_live(self):
+        """
+        Metrics which change on every collection, like the age of the snapshot
+        """
+        if self.poller is not None:
+            yield from self.poller.age_metric()
+        if self.docsis_sampler is not None:
+            yield from self.docsis_sampler.metrics()
+        if self.poller is None:
+            coalesced = CounterMetricFamily(
+                "tg3442de_coalesced_requests",
+                "Number of collections served by a scrape already running, by result",
+                labels=["result"],
+            )
+            coalesced.add_metric(["shared"], self.single_flight.coalesced - self.single_flight.timeouts)
+            coalesced.add_metric(["timeout"], self.single_flight.timeouts)
+            yield coalesced
+
+        breaker_state = GaugeMetricFamily(
+            "tg3442de_circuit_breaker_state",
+            "State of the circuit breaker stopping scrapes of an unresponsive TG3442DE",
+            labels=["state"],
+        )
+        for state in [CLOSED, OPEN, HALF_OPEN]:
+            breaker_state.add_metric([state], int(self.breaker.state == state))
+        yield breaker_state
+        yield GaugeMetricFamily(
+            "tg3442de_metrics_stale",
+            "1 if the metrics of the last successful scrape are served while the circuit breaker is open",
+            value=int(self.stale),
+        )
+        yield GaugeMetricFamily(
+            "tg3442de_request_timeout",
+            "Timeout of the next request to the TG3442DE",
+            unit="seconds",
+            value=self.latency.adaptive_timeout(),
+        )
+        if self.latency.average is not None:
+            yield GaugeMetricFamily(
+                "tg3442de_request_latency_average",
+                "Exponentially weighted moving average of the TG3442DE request latency",
+                unit="seconds",
+                value=self.latency.average,
+            )
 
     def collect(self):
+        yield from self.collect_cacheable()
+        yield from self.collect_live()
+
+    def fetch_page(self, box, page: str, fetch_duration: Dict[str, float], deadline: Optional[float] = None) -> str:
+        self.logger.debug(f"Querying page={page}...")
+        pre_fetch_time = time.time()
+        # pages may be fetched on the threads of the fetch executor, the deadline is set per thread
+        with self.latency.deadline(deadline):
+            raw_html = self.profiler.run(lambda: self.session.html_getter(box, page))
+        fetch_duration[page] = time.time() - pre_fetch_time
+        self.logger.debug(
+            f"Raw HTML response for page={page}:\n{raw_html}"
+        )
+        return raw_html
+
+    def guarded_scrape(self) -> List[Metric]:
+        """
+        Scrapes the TG3442DE unless the circuit breaker is open
+        :return: metric families, those of the last successful scrape while the circuit is open
+        """
+        if not self.breaker.allow():
+            self.logger.info(f"Circuit breaker open, serving the last metrics of {self.ip_address}")
+            self.stale = True
+            # only the extracted metrics are served from the last scrape, the TG3442DE is reported down
+            scrape_success = {extractor.name: False for extractor in self.metric_extractors}
+            scrape_success["login_logout"] = False
+            return self.last_good + list(self.status_metrics({}, {}, scrape_success))
+        families = self.profiler.run(lambda: list(self.scrape()))
+        if self.scrape_failed:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+            self.last_good = self.extracted
+        self.stale = False
+        return families
+
+    def scrape(self):
         # Collect scrape duration and scrape success for each extractor. Scrape success is initialized with False for
         # all extractors so that we can report a value for each extractor even in cases where we abort midway through
         # because we lost connection to the modem.
         scrape_duration = {}  # type: Dict[str, float]
+        fetch_duration = {}  # type: Dict[str, float]
         scrape_success = {}
         self.logger.info("Collecting from " + self.ip_address)
+        self.scrape_failed = False
+        # metric families of the extractors, kept as last known good metrics
+        extracted = []  # type: List[Metric]
+        pre_scrape_time = time.time()
+        deadline = pre_scrape_time + self.scrape_deadline if self.scrape_deadline > 0 else None
+        # time spent waiting for pages and extracting metrics, over all extractors
+        fetch_wait = 0.0
+        extract_duration = 0.0
+        phase_duration = {}  # type: Dict[str, float]
+        response_sizes = {}  # type: Dict[str, int]
+        extract_steps = {}  # type: Dict[str, Dict[str, float]]
+
+        # extractors whose interval did not pass yet are served from their last result
+        now = time.time()
+        due_extractors = []
+        for extractor in self.metric_extractors:
+            if self.scheduler.is_due(extractor.name, now):
+                due_extractors.append(extractor)
+            else:
+                cached = self.scheduler.cached(extractor.name)
+                extracted.extend(cached)
+                yield from cached
+                scrape_success[extractor.name] = True
 
-        # attempt login
+        # attempt login, if any extractor has to query the modem
         login_logout_success = True
-        try:
-            box = TG3442DE(
-                self.logger, self.ip_address, key=self.password, timeout=self.timeout, simulate=self.simulate
-            )
-            box.login()
-        except (ConnectionError, Timeout, ValueError) as e:
-            self.logger.error(repr(e))
-            box = None
-            login_logout_success = False
+        box = None
+        if due_extractors:
+            try:
+                with self.instrumentation.phase("login", phase_duration), self.latency.deadline(deadline):
+                    box = self.session.acquire()
+            except (ConnectionError, RequestException, ValueError) as e:
+                self.logger.error(repr(e))
+                self.instrumentation.failure("login", e)
+                self.session.invalidate()
+                login_logout_success = False
+                self.scrape_failed = True
 
         # skip extracting further metrics if login failed
         if box is not None:
-            for extractor in self.metric_extractors:
+            # pages shared by several extractors are fetched only once
+            page_cache = PageCache(
+                lambda page: self.fetch_page(box, page, fetch_duration, deadline), self.fetch_executor
+            )
+            pages = {page for extractor in due_extractors for page in extractor.pages}
+            if self.async_client:
+                pre_fetch_time = time.time()
+                try:
+                    with self.latency.deadline(deadline):
+                        results = self.session.fetch_pages(box, pages, fetch_duration)
+                except ConnectionError as e:
+                    # the deadline passed while fetching, all pages fail
+                    results = {page: e for page in pages}
+                page_cache.update(results)
+                fetch_wait += time.time() - pre_fetch_time
+            else:
+                page_cache.prefetch(pages)
+
+            for extractor in due_extractors:
                 #self.logger.debug("extractor ="+str(extractor))
                 raw_htmls = {}
+                phase = "fetch"
                 try:
-                    pre_scrape_time = time.time()
+                    pre_extractor_time = time.time()
 
                     # obtain all raw html responses for an extractor, then extract metrics
                     for page in extractor.pages:
-                        self.logger.debug(f"Querying page={page}...")
-                        raw_html = box.html_getter(page, "")
-                        self.logger.debug(
-                            f"Raw HTML response for page={page}:\n{raw_html}"
-                        )
-                        raw_htmls[page] = raw_html
-                    yield from extractor.extract(raw_htmls)
-                    post_scrape_time = time.time()
-
-                    scrape_duration[extractor.name] = post_scrape_time - pre_scrape_time
+                        raw_htmls[page] = page_cache.get(page)
+                    pre_extract_time = time.time()
+                    fetch_wait += pre_extract_time - pre_extractor_time
+                    phase = "extract"
+                    # reuse the families built from the same content before
+                    families = None
+                    if extractor.cacheable:
+                        digests = {page: page_cache.digest(page) for page in extractor.pages}
+                        families = self.content_cache.lookup(extractor.name, digests)
+                    if families is None:
+                        extractor.parse_duration = 0.0
+                        try:
+                            families = list(extractor.extract(raw_htmls))
+                        finally:
+                            # timed also for failing extractors
+                            duration = time.time() - pre_extract_time
+                            extract_duration += duration
+                            extract_steps[extractor.name] = {
+                                "parse": extractor.parse_duration,
+                                "build": duration - extractor.parse_duration,
+                            }
+                        if extractor.cacheable:
+                            self.content_cache.store(extractor.name, digests, families)
+                    post_extractor_time = time.time()
+                    self.scheduler.store(extractor.name, families, pre_extractor_time)
+                    extracted.extend(families)
+                    yield from families
+
+                    scrape_duration[extractor.name] = post_extractor_time - pre_extractor_time
                     scrape_success[extractor.name] = True
 
                 except (ValueError, KeyError, AssertionError) as e:
                     stack = traceback.format_exc()
                     message = f"Failed to extract '{extractor.name}'. \n{stack}"
                     self.logger.error(message)
+                    self.instrumentation.failure(phase, e)
                 except (AttributeError) as e:
                     # in case of a less serious error, log and continue scraping the next extractor
                     stack = traceback.format_exc()
                     message = f"Failed to extract '{extractor.name}'. raw_htmls:\n{stack}\n{raw_htmls}"                    
                     self.logger.error(message)
+                    self.instrumentation.failure(phase, e)
                 except Exception as e:
                     # in case of serious connection issues, abort and do not try the next extractor
                     stack = traceback.format_exc()
                     message = f"Failed to extract '{extractor.name}'. raw_htmls:\n{stack}\n{raw_htmls}"                    
                     self.logger.error(message)
+                    self.instrumentation.failure(phase, e)
+                    self.session.invalidate()
+                    self.scrape_failed = True
                     break
 
-            # attempt logout once done
+            # prefetches of extractors skipped after a failure must not use the box after logout
+            page_cache.cancel()
+
+            # attempt logout once done, unless the session is kept for the next scrape
             try:
-                box.logout()
+                with self.instrumentation.phase("logout", phase_duration):
+                    self.session.release(box)
             except Exception as e:
                 self.logger.error(repr(e))
+                self.instrumentation.failure("logout", e)
                 login_logout_success = False
+
+            phase_duration["fetch"] = fetch_wait
+            phase_duration["extract"] = extract_duration
+            for page in fetch_duration:
+                # pages with fetch duration were fetched successfully, sized in bytes as sent by the modem
+                response_sizes[page] = len(page_cache.get(page).encode("utf-8"))
         scrape_success["login_logout"] = int(login_logout_success)
+        phase_duration["total"] = time.time() - pre_scrape_time
+        self.instrumentation.record(
+            pre_scrape_time, phase_duration, fetch_duration, response_sizes, extract_steps, self.scrape_failed
+        )
+        self.extracted = extracted
+        yield from self.status_metrics(scrape_duration, fetch_duration, scrape_success)
 
+    def status_metrics(self, scrape_duration: Dict[str, float], fetch_duration: Dict[str, float],
+                       scrape_success: Dict[str, bool]) -> Iterable[Metric]:
+        """
+        Metrics about the scrape itself, the session and the caches
+        :param scrape_duration: duration by extractor
+        :param fetch_duration: duration by page
+        :param scrape_success: success by extractor and 'login_logout'
+        :return: metrics iterable
+        """
         # create metrics from previously durations and successes collected
         EXTRACTOR = "extractor"
         scrape_duration_metric = GaugeMetricFamily(
@@ -144,6 +451,16 @@ class TG3442DECollector(object):
             scrape_duration_metric.add_metric([name], duration)
         yield scrape_duration_metric
 
+        fetch_duration_metric = GaugeMetricFamily(
+            "tg3442de_page_fetch_duration",
+            documentation="Fetch duration by TG3442DE page",
+            unit="seconds",
+            labels=["page"],
+        )
+        for page, duration in fetch_duration.items():
+            fetch_duration_metric.add_metric([page], duration)
+        yield fetch_duration_metric
+
         scrape_success_metric = GaugeMetricFamily(
             "tg3442de_up",
             documentation="TG3442DE exporter scrape success by extractor",
@@ -153,6 +470,71 @@ class TG3442DECollector(object):
             scrape_success_metric.add_metric([name], int(success))
         yield scrape_success_metric
 
+        yield CounterMetricFamily(
+            "tg3442de_session_logins",
+            "Number of logins performed on the TG3442DE",
+            value=self.session.logins,
+        )
+        yield CounterMetricFamily(
+            "tg3442de_session_reused",
+            "Number of scrapes served by an already logged-in session",
+            value=self.session.reuses,
+        )
+
+        login_phase_metric = GaugeMetricFamily(
+            "tg3442de_login_phase_duration",
+            documentation="Duration of the phases of the last login",
+            unit="seconds",
+            labels=["phase"],
+        )
+        for phase, duration in self.session.login_timings.items():
+            login_phase_metric.add_metric([phase], duration)
+        yield login_phase_metric
+
+        key_cache_metric = CounterMetricFamily(
+            "tg3442de_login_key_cache",
+            "Lookups of PBKDF2 derived login keys by result",
+            labels=["result"],
+        )
+        for result, count in self.session.key_cache_stats.items():
+            key_cache_metric.add_metric([result], count)
+        yield key_cache_metric
+
+        yield from self.content_cache.metrics()
+        yield from self.instrumentation.metrics()
+
+    def log_stores(self) -> Dict:
+        """
+        Local log stores of the configured extractors, by kind ('calls', 'events')
+        """
+        kinds = {CALL_LOG_LOCAL: "calls", EVENT_LOG_LOCAL: "events"}
+        return {
+            kinds[extractor.name]: extractor.store
+            for extractor in self.metric_extractors if extractor.name in kinds
+        }
+
+    def close(self):
+        """
+        Stops background polling and page fetching and logs out a kept session on shutdown
+        """
+        if self.poller is not None:
+            self.poller.stop()
+        if self.docsis_sampler is not None:
+            self.docsis_sampler.stop()
+        for store in self.log_stores().values():
+            store.stop()
+        if self.fetch_executor is not None:
+            self.fetch_executor.shutdown()
+        try:
+            self.session.close()
+        except Exception as e:
+            self.logger.error(repr(e))
+
+
+def _terminate(signum, frame):
+    # shut down on SIGTERM (docker stop, systemd) like on Ctrl-C
+    raise KeyboardInterrupt
+
 
 @click.command()
 @click.argument("config_file", type=click.Path(exists=True, dir_okay=False))
@@ -173,31 +555,63 @@ def main(config_file='config.yml', debug=False):
     exporter_config = config[EXPORTER]
     
 
-    # fire up collector
+    # fire up collector, one per TG3442DE in multi-target mode
     reg = CollectorRegistry()
-    reg.register(
-        TG3442DECollector(
+    profiler = ScrapeProfiler()
+    multi_target = None
+    if TARGETS in config:
+        collectors = {
+            target[TARGET_NAME]: TG3442DECollector(
+                logger,
+                ip_address=target[IP_ADDRESS],
+                password=target[PASSWORD],
+                exporter_config=target_exporter_config(config, target),
+                profiler=profiler,
+            )
+            for target in config[TARGETS]
+        }
+        collector = multi_target = MultiTargetCollector(
+            logger, collectors, exporter_config[MAX_CONCURRENT_TARGETS]
+        )
+        querying = ", ".join(collectors.keys())
+        log_stores = {name: collector.log_stores() for name, collector in collectors.items()}
+        instrumentations = {name: collector.instrumentation for name, collector in collectors.items()}
+    else:
+        collector = TG3442DECollector(
             logger,
             ip_address=config[IP_ADDRESS],
             password=config[PASSWORD],
             exporter_config= config[EXPORTER],
+            profiler=profiler,
         )
-    )
+        querying = config[IP_ADDRESS]
+        log_stores = {None: collector.log_stores()}
+        instrumentations = {None: collector.instrumentation}
+    reg.register(collector)
+    collector.start()
 
     # start http server
-    CustomMetricsHandler = MetricsHandler.factory(reg)
+    debug = (exporter_config[DEBUG_ENDPOINTS] == 1)
+    if exporter_config[LOG_ENDPOINTS] != 1:
+        log_stores = None
+    CustomMetricsHandler = TG3442DEMetricsHandler.factory(
+        reg, multi_target, log_stores, ExpositionCache(collector), openmetrics=(exporter_config[OPENMETRICS] == 1),
+        profiler=profiler if debug else None, instrumentations=instrumentations if debug else None,
+    )
     httpd = _ThreadingSimpleServer(("", exporter_config[PORT]), CustomMetricsHandler)
     httpd_thread = threading.Thread(target=httpd.serve_forever)
     httpd_thread.start()
 
     logger.info(
-        f"Exporter running at http://localhost:{exporter_config[PORT]}, querying {config[IP_ADDRESS]}"
+        f"Exporter running at http://localhost:{exporter_config[PORT]}, querying {querying}"
     )
 
     # wait indefinitely
+    signal.signal(signal.SIGTERM, _terminate)
     try:
         while True:
             time.sleep(3)
     except KeyboardInterrupt:
         httpd.shutdown()
         httpd_thread.join()
+        collector.close()